@@ -0,0 +1,173 @@
+import base64
+import sqlite3
+from datetime import datetime
+
+from booking_state import ACTIVATING, ACTIVE, PENDING, STOPPING
+
+# Bookings per page of the admin bookings view
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+STATUSES = (PENDING, ACTIVATING, ACTIVE, STOPPING)
+# Accepted time formats, as typed or sent by a datetime-local input
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+def parse_time(value: str) -> str:
+    """
+    Parse a time filter into the format bookings are stored in.
+
+    Args:
+        value (str): The time, e.g. "2025-06-01" or "2025-06-01T12:30".
+
+    Returns:
+        str: The time as "%Y-%m-%d %H:%M:%S".
+
+    Raises:
+        ValueError: If the time is malformed.
+    """
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    raise ValueError("times must be given as YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+
+def parse_filters(status: str = None, user: str = None, scooter: str = None,
+                  start: str = None, end: str = None) -> dict:
+    """
+    Validate the filters of the admin bookings view. Empty filters are left out.
+
+    Args:
+        status (str): Only bookings in this state.
+        user (str): Only bookings of the user with this username.
+        scooter (str): Only bookings of the scooter with this ID.
+        start (str): Only bookings created at or after this time.
+        end (str): Only bookings created before this time.
+
+    Returns:
+        dict: The filters that are set.
+
+    Raises:
+        ValueError: If a filter is invalid.
+    """
+    filters = {}
+    if status:
+        if status not in STATUSES:
+            raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+        filters["status"] = status
+    if user:
+        filters["user"] = user
+    if scooter:
+        try:
+            filters["scooter"] = int(scooter)
+        except ValueError:
+            raise ValueError("scooter must be a scooter ID") from None
+    if start:
+        filters["start"] = parse_time(start)
+    if end:
+        filters["end"] = parse_time(end)
+    if "start" in filters and "end" in filters and filters["start"] >= filters["end"]:
+        raise ValueError("start must be before end")
+    return filters
+
+def encode_cursor(created_at: str, booking_id: int) -> str:
+    """
+    Encode the position after a booking as an opaque page cursor.
+
+    Args:
+        created_at (str): When the booking was created.
+        booking_id (int): The ID of the booking.
+
+    Returns:
+        str: The cursor.
+    """
+    return base64.urlsafe_b64encode(f"{created_at}|{booking_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decode a page cursor.
+
+    Args:
+        cursor (str): A cursor returned by encode_cursor().
+
+    Returns:
+        tuple: The (created_at, booking_id) of the last booking on the previous page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        created_at, booking_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        return parse_time(created_at), int(booking_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor") from None
+
+def bookings_page(conn: sqlite3.Connection, filters: dict, cursor: str = None, limit: int = PAGE_SIZE) -> tuple:
+    """
+    Fetch one page of bookings, newest first.
+
+    Pages are keyed on (created_at, id) rather than an offset, so every page
+    is a single range scan of an index on created_at and costs the same however
+    deep it is and however large the table grows.
+
+    Args:
+        conn (sqlite3.Connection): A database connection.
+        filters (dict): Filters returned by parse_filters().
+        cursor (str): The cursor of the page to fetch, or None for the first page.
+        limit (int): The maximum number of bookings on the page.
+
+    Returns:
+        tuple: The bookings and the cursor of the next page (None on the last page).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    conditions, params = [], []
+    if "status" in filters:
+        conditions.append("b.status = ?")
+        params.append(filters["status"])
+    if "user" in filters:
+        conditions.append("b.user_id = (SELECT id FROM users WHERE username = ?)")
+        params.append(filters["user"])
+    if "scooter" in filters:
+        conditions.append("b.scooter_id = ?")
+        params.append(filters["scooter"])
+    if "start" in filters:
+        conditions.append("b.created_at >= ?")
+        params.append(filters["start"])
+    if "end" in filters:
+        conditions.append("b.created_at < ?")
+        params.append(filters["end"])
+    if cursor:
+        conditions.append("(b.created_at, b.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # One extra row tells whether there is a next page
+    rows = conn.execute(f"""
+        SELECT b.id, b.scooter_id, b.status, b.expires_at, b.created_at, s.battery, u.username
+        FROM bookings b
+        JOIN scooters s ON b.scooter_id = s.id
+        JOIN users u ON b.user_id = u.id
+        {where}
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT ?
+    """, (*params, limit + 1)).fetchall()
+
+    bookings = [
+        {
+            "id": row[0],
+            "scooter_id": row[1],
+            "status": row[2],
+            "expires_at": row[3],
+            "created_at": row[4],
+            "battery": row[5],
+            "username": row[6]
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = bookings[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    return bookings, next_cursor
@@ -0,0 +1,60 @@
+import sqlite3
+
+# Booking states
+PENDING = "pending"        # Booked, waiting for the user to start the ride
+ACTIVATING = "activating"  # Start command sent, waiting for the scooter
+ACTIVE = "active"          # Ride in progress
+STOPPING = "stopping"      # Stop command sent, waiting for the scooter
+STATES = (PENDING, ACTIVATING, ACTIVE, STOPPING)
+
+# Allowed status changes. A finished ride (stopping) or a cancelled or expired
+# booking (pending) leaves the state machine by being deleted.
+TRANSITIONS = {
+    PENDING: (ACTIVATING,),
+    ACTIVATING: (ACTIVE, PENDING),
+    ACTIVE: (STOPPING,),
+    STOPPING: (ACTIVE,),
+}
+
+def transition(conn: sqlite3.Connection, booking_id: int, source: str, target: str, user_id: int = None, **columns):
+    """
+    Atomically move a booking from one state to another.
+
+    The update only applies if the booking is still in the source state (and
+    belongs to the user, if given), so concurrent requests cannot both win.
+
+    Args:
+        conn (sqlite3.Connection): A connection inside an open write transaction.
+        booking_id (int): The ID of the booking.
+        source (str): The state the booking must be in.
+        target (str): The new state.
+        user_id (int): The user the booking must belong to, if any.
+        **columns: Other booking columns to set along with the status.
+
+    Returns:
+        tuple or None: The booking's (scooter_id, expires_at, activated_at)
+        after the change, or None if the booking was not in the source state.
+
+    Raises:
+        ValueError: If the state machine does not allow the transition.
+    """
+    if target not in TRANSITIONS[source]:
+        raise ValueError(f"Invalid booking transition {source} -> {target}")
+
+    assignments = "".join(f", {column} = :{column}" for column in columns)
+    ownership = " AND user_id = :user_id" if user_id is not None else ""
+    return conn.execute(f"""
+        UPDATE bookings SET status = :target{assignments}
+        WHERE id = :booking_id AND status = :source{ownership}
+        RETURNING scooter_id, expires_at, activated_at
+    """, {"booking_id": booking_id, "source": source, "target": target, "user_id": user_id, **columns}).fetchone()
+
+def recover_interrupted(conn: sqlite3.Connection):
+    """
+    Roll back bookings left waiting for a scooter when the server stopped.
+
+    Args:
+        conn (sqlite3.Connection): A connection inside an open write transaction.
+    """
+    conn.execute("UPDATE bookings SET status = ? WHERE status = ?", (PENDING, ACTIVATING))
+    conn.execute("UPDATE bookings SET status = ? WHERE status = ?", (ACTIVE, STOPPING))
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Database location (override with SCOOTER_DB, e.g. for benchmarks)
+DATABASE = os.environ.get("SCOOTER_DB", "scooter_app.db")
+
+# Pool sizing
+READ_POOL_SIZE = 8
+WRITE_POOL_SIZE = 1  # SQLite allows a single writer at a time, even in WAL mode
+ACQUIRE_TIMEOUT = 5.0  # Seconds to wait for a free connection
+
+# Pragmas applied to every pooled connection
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",  # Safe with WAL, avoids an fsync per commit
+    "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 67108864",  # 64 MB memory-mapped I/O
+)
+
+class ConnectionPool:
+    """
+    A thread-safe pool of reusable SQLite connections.
+    """
+
+    def __init__(self, database: str, size: int, read_only: bool = False):
+        self.database = database
+        self.size = size
+        self.read_only = read_only
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a new connection with the pool's pragmas applied.
+
+        Returns:
+            sqlite3.Connection: The new connection.
+        """
+        # Autocommit mode: transactions are managed explicitly by transaction()
+        conn = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Take a connection from the pool, opening a new one if the pool is not full.
+
+        Returns:
+            sqlite3.Connection: A pooled connection.
+
+        Raises:
+            TimeoutError: If no connection becomes available in time.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a database connection")
+
+    def release(self, conn: sqlite3.Connection):
+        """
+        Return a connection to the pool.
+
+        Args:
+            conn (sqlite3.Connection): The connection to return.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    def close_all(self):
+        """
+        Close every idle connection in the pool.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+# Separate pools for the read and write paths
+_read_pool = ConnectionPool(DATABASE, READ_POOL_SIZE, read_only=True)
+_write_pool = ConnectionPool(DATABASE, WRITE_POOL_SIZE)
+
+@contextmanager
+def read_connection():
+    """
+    Borrow a read-only connection from the pool.
+
+    Yields:
+        sqlite3.Connection: A read-only connection.
+    """
+    conn = _read_pool.acquire()
+    try:
+        yield conn
+    finally:
+        _read_pool.release(conn)
+
+@contextmanager
+def transaction():
+    """
+    Borrow the writer connection and run the block in a single transaction.
+
+    The transaction is committed when the block exits normally and rolled back
+    if it raises.
+
+    Yields:
+        sqlite3.Connection: The writer connection, inside an open transaction.
+    """
+    conn = _write_pool.acquire()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        _write_pool.release(conn)
+
+# Dedicated threads for database work started from async code, sized to the pools.
+# The single write thread serialises writers instead of blocking on the SQLite lock.
+_read_executor = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(max_workers=WRITE_POOL_SIZE, thread_name_prefix="db-write")
+
+async def run_blocking(fn, *args):
+    """
+    Run a blocking function on a database read thread without blocking the event loop.
+
+    Args:
+        fn (callable): The function to run.
+        *args: Arguments passed to the function.
+
+    Returns:
+        The function's return value.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, fn, *args)
+
+async def run_read(fn, *args):
+    """
+    Run fn(conn, *args) with a read-only connection on a database thread.
+
+    Args:
+        fn (callable): The function to run.
+        *args: Extra arguments passed to the function.
+
+    Returns:
+        The function's return value.
+    """
+    def task():
+        with read_connection() as conn:
+            return fn(conn, *args)
+
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, task)
+
+async def run_write(fn, *args):
+    """
+    Run fn(conn, *args) in a write transaction on the database writer thread.
+
+    The transaction is committed if the function returns and rolled back if
+    it raises.
+
+    Args:
+        fn (callable): The function to run.
+        *args: Extra arguments passed to the function.
+
+    Returns:
+        The function's return value.
+    """
+    def task():
+        with transaction() as conn:
+            return fn(conn, *args)
+
+    return await asyncio.get_running_loop().run_in_executor(_write_executor, task)
+
+def close_pools():
+    """
+    Close all pooled connections.
+    """
+    _read_pool.close_all()
+    _write_pool.close_all()
@@ -1,25 +1,59 @@
+import argparse
+import calendar
 import random
 import sqlite3
+from datetime import datetime
 
-# Database setup
-DATABASE = "scooter_app.db"
+from booking_state import recover_interrupted
+from db import DATABASE, transaction
+from ratings import RATINGS_TRIGGER, rebuild_ratings
+
+# Seed for generated data, so the same arguments always generate the same rows
+DEFAULT_SEED = 20
+
+# Generated bookings and feedback are dated before this, so they never depend on the clock
+SEED_END = datetime(2026, 1, 1)
+
+# Share of generated bookings that are reservations not yet started; the rest are rides in progress
+PENDING_SHARE = 0.2
+
+# Areas scooters are placed in, as (center lat, center lng, lat span, lng span)
+TRONDHEIM = (63.422, 10.395, 0.02, 0.08)
 
 def initialize_database():
     """
-    Initialize the SQLite database with required tables and initial data.
+    Bring the SQLite database up to the current schema version.
+
+    Only migrations newer than the version stored in the database are run, so
+    existing data is kept and a warm restart does no work.
+    """
+    with transaction() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"Applying database migration {number}: {migration.__doc__.strip().splitlines()[0]}")
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {number}")
+
+    # Refresh query planner statistics if they are out of date
+    with transaction() as conn:
+        conn.execute("PRAGMA optimize")
+
+def recover_bookings():
     """
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    Roll back bookings left activating or stopping by a previous run.
 
-    # Clear existing data
-    cursor.execute("DROP TABLE IF EXISTS feedback")
-    cursor.execute("DROP TABLE IF EXISTS scooters")
-    cursor.execute("DROP TABLE IF EXISTS users")
-    cursor.execute("DROP TABLE IF EXISTS bookings")
+    Must only be called before the server starts handling requests.
+    """
+    with transaction() as conn:
+        recover_interrupted(conn)
 
-    # Enable foreign key constraints
-    cursor.execute("PRAGMA foreign_keys = ON")
+def _migration_1_create_tables(cursor):
+    """
+    Create the tables and insert the initial data.
 
+    Args:
+        cursor (sqlite3.Cursor): A cursor inside an open write transaction.
+    """
     # Create tables
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -40,6 +74,40 @@ def initialize_database():
         needs_fixing BOOLEAN NOT NULL DEFAULT 0
     )
     """)
+
+    # Spatial index over scooter positions, kept in sync by triggers
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS scooters_rtree USING rtree(
+        id,
+        min_lat, max_lat,
+        min_lng, max_lng
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS scooters_rtree_insert AFTER INSERT ON scooters
+    BEGIN
+        INSERT INTO scooters_rtree VALUES (new.id, new.lat, new.lat, new.lng, new.lng);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS scooters_rtree_update AFTER UPDATE OF lat, lng ON scooters
+    BEGIN
+        UPDATE scooters_rtree
+        SET min_lat = new.lat, max_lat = new.lat, min_lng = new.lng, max_lng = new.lng
+        WHERE id = new.id;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS scooters_rtree_delete AFTER DELETE ON scooters
+    BEGIN
+        DELETE FROM scooters_rtree WHERE id = old.id;
+    END
+    """)
+    # Index scooters from databases created before the spatial index existed
+    cursor.execute("""
+    INSERT OR IGNORE INTO scooters_rtree
+    SELECT id, lat, lat, lng, lng FROM scooters
+    """)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS feedback (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -67,7 +135,10 @@ def initialize_database():
     )
     """)
 
-    # Insert initial data
+    # Insert initial data into a new database
+    if cursor.execute("SELECT COUNT(*) FROM scooters").fetchone()[0]:
+        return
+
     cursor.execute("""
         INSERT OR IGNORE INTO users (username, password, email, is_admin)
         VALUES ('admin', 'admin123', 'admin@ntnu.no', 1)
@@ -86,5 +157,386 @@ def initialize_database():
             VALUES (?, ?, ?)
         """, (lat, lng, battery))
 
-    conn.commit()
-    conn.close()
\ No newline at end of file
+def _migration_2_add_indexes(cursor):
+    """
+    Add indexes for the lookups made by the app and the expiry scheduler.
+
+    Usernames are already indexed by their UNIQUE constraint.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor inside an open write transaction.
+    """
+    # Registration: duplicate email check
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)")
+    # Expiry scheduler: pending bookings and their deadlines
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_status_expires ON bookings (status, expires_at)")
+    # Bookings page: a user's bookings
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id)")
+    # Collisions: active booking of a scooter
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_scooter_status ON bookings (scooter_id, status)")
+    # Maintenance page: covers the scooters needing fixing
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scooters_needs_fixing ON scooters (needs_fixing, lat, lng, battery)")
+    cursor.execute("ANALYZE")
+
+def _migration_3_booking_states(cursor):
+    """
+    Allow the activating and stopping booking states.
+
+    SQLite cannot alter a CHECK constraint, so the bookings table is rebuilt.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor inside an open write transaction.
+    """
+    cursor.execute("""
+    CREATE TABLE bookings_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        scooter_id INTEGER NOT NULL,
+        status TEXT NOT NULL CHECK (status IN ('pending', 'activating', 'active', 'stopping')),
+        expires_at DATETIME NOT NULL,
+        created_at DATETIME NOT NULL,
+        activated_at DATETIME,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (scooter_id) REFERENCES scooters (id)
+    )
+    """)
+    cursor.execute("INSERT INTO bookings_new SELECT * FROM bookings")
+    cursor.execute("DROP TABLE bookings")
+    cursor.execute("ALTER TABLE bookings_new RENAME TO bookings")
+    cursor.execute("CREATE INDEX idx_bookings_status_expires ON bookings (status, expires_at)")
+    cursor.execute("CREATE INDEX idx_bookings_user ON bookings (user_id)")
+    cursor.execute("CREATE INDEX idx_bookings_scooter_status ON bookings (scooter_id, status)")
+
+def _migration_4_booking_page_indexes(cursor):
+    """
+    Index bookings for the paginated admin bookings view.
+
+    Pages are ordered by (created_at, id), so each filter gets an index ending
+    in created_at; the row ID is implicitly the last column of every index.
+    The user and scooter indexes replace the ones on user_id and
+    (scooter_id, status), whose lookups they still cover.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor inside an open write transaction.
+    """
+    # No filter or a time range
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_status_created ON bookings (status, created_at)")
+    cursor.execute("DROP INDEX IF EXISTS idx_bookings_user")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user_created ON bookings (user_id, created_at)")
+    cursor.execute("DROP INDEX IF EXISTS idx_bookings_scooter_status")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_scooter_created ON bookings (scooter_id, created_at)")
+    cursor.execute("ANALYZE")
+
+def _migration_5_rides(cursor):
+    """
+    Keep a record of finished rides.
+
+    Bookings are deleted when a ride ends, so the ride's times and cost are
+    saved here for finance exports.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor inside an open write transaction.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rides (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        scooter_id INTEGER NOT NULL,
+        started_at DATETIME NOT NULL,
+        ended_at DATETIME NOT NULL,
+        cost REAL NOT NULL,
+        parking_fee REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (scooter_id) REFERENCES scooters (id)
+    )
+    """)
+
+def _migration_6_scooter_ratings(cursor):
+    """
+    Keep rating aggregates per scooter, updated as feedback comes in.
+
+    scooter_ratings holds the count, sum and histogram of every scooter's
+    ratings, and scooter_rating_days the count and sum per day for the
+    rolling average. A trigger updates both on every insert into feedback,
+    which now records when it was given.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor inside an open write transaction.
+    """
+    cursor.execute("ALTER TABLE feedback ADD COLUMN created_at DATETIME")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS scooter_ratings (
+        scooter_id INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        stars_1 INTEGER NOT NULL,
+        stars_2 INTEGER NOT NULL,
+        stars_3 INTEGER NOT NULL,
+        stars_4 INTEGER NOT NULL,
+        stars_5 INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS scooter_rating_days (
+        scooter_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        count INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        PRIMARY KEY (scooter_id, day)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute(RATINGS_TRIGGER)
+    rebuild_ratings(cursor.connection)
+
+# Schema migrations, applied in order. The schema version is stored in PRAGMA user_version.
+MIGRATIONS = [
+    _migration_1_create_tables,
+    _migration_2_add_indexes,
+    _migration_3_booking_states,
+    _migration_4_booking_page_indexes,
+    _migration_5_rides,
+    _migration_6_scooter_ratings,
+]
+
+def insert_scooters(conn: sqlite3.Connection, rng: random.Random, count: int, areas: list,
+                    min_battery: int = 5, booked: int = 0) -> int:
+    """
+    Insert generated scooters spread evenly over the given areas.
+
+    The rows are generated by SQLite from the seeded random generator, so the
+    same generator state always produces the same scooters.
+
+    Args:
+        conn (sqlite3.Connection): A connection inside an open write transaction.
+        rng (random.Random): The random generator.
+        count (int): The number of scooters.
+        areas (list): (center lat, center lng, lat span, lng span) tuples.
+        min_battery (int): The lowest battery level in percent.
+        booked (int): How many of the new scooters to mark as booked.
+
+    Returns:
+        int: The ID of the first new scooter.
+    """
+    conn.create_function("seeded_random", 0, rng.random)
+    first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM scooters").fetchone()[0]
+    area_rows = " UNION ALL ".join(f"SELECT {n}, ?, ?, ?, ?" for n in range(len(areas)))
+    conn.execute(f"""
+        WITH RECURSIVE
+            seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?),
+            areas(n, lat, lng, lat_span, lng_span) AS ({area_rows})
+        INSERT INTO scooters (id, lat, lng, battery, isBooked)
+        SELECT
+            ? + i,
+            lat + (seeded_random() - 0.5) * lat_span,
+            lng + (seeded_random() - 0.5) * lng_span,
+            ? + CAST(seeded_random() * (101 - ?) AS INTEGER),
+            i < ?
+        FROM seq JOIN areas ON n = i % ?
+    """, (count, *[value for area in areas for value in area], first, min_battery, min_battery, booked, len(areas)))
+    return first
+
+def seed_database(scooters: int = 0, users: int = 0, bookings: int = 0, feedback: int = 0,
+                  areas: list = None, seed: int = DEFAULT_SEED, replace: bool = False):
+    """
+    Add generated scooters, users, bookings and feedback to the database.
+
+    The same arguments always generate the same data. Users are named
+    user<id> with the password "password". Bookings are open, as finished
+    ones are deleted: one on each of the first new scooters, which are marked
+    as booked. PENDING_SHARE of them are reservations made in the 15 minutes
+    before SEED_END, the rest rides started in the hour before it. Seeded
+    reservations have expired by the time the app runs, so it releases them
+    on startup like after any downtime.
+
+    All rows are generated inside SQLite with INSERT ... SELECT, on a
+    dedicated connection without foreign key checks (every reference points
+    at a row generated here). Indexes and the spatial index triggers are
+    dropped while inserting and rebuilt in one pass at the end.
+
+    Args:
+        scooters (int): The number of scooters to add.
+        users (int): The number of users to add.
+        bookings (int): The number of bookings to add (needs scooters and
+            users, and at most one per new scooter).
+        feedback (int): The number of feedback rows to add (needs scooters and users).
+        areas (list): (center lat, center lng, lat span, lng span) tuples to
+            spread the scooters over (default: Trondheim).
+        seed (int): The random seed.
+        replace (bool): Delete all scooters, bookings, feedback and users
+            other than admins first.
+    """
+    if (bookings or feedback) and not (scooters and users):
+        raise ValueError("Bookings and feedback need new scooters and users to refer to")
+    if bookings > scooters:
+        raise ValueError("A scooter can only have one open booking, so bookings cannot outnumber new scooters")
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(DATABASE, isolation_level=None)
+    conn.create_function("seeded_random", 0, rng.random)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -256000")  # 256 MB
+    conn.execute("PRAGMA temp_store = MEMORY")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if replace:
+            conn.execute("DELETE FROM bookings")
+            conn.execute("DELETE FROM rides")
+            conn.execute("DELETE FROM feedback")
+            conn.execute("DELETE FROM scooters")
+            conn.execute("DELETE FROM users WHERE is_admin = 0")
+
+        # Drop the secondary indexes and triggers, to rebuild them in one pass at the end
+        deferred = conn.execute("""
+            SELECT type, name, sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+            AND tbl_name IN ('scooters', 'users', 'bookings', 'feedback')
+        """).fetchall()
+        for kind, name, _ in deferred:
+            conn.execute(f"DROP {kind.upper()} {name}")
+
+        first_scooter = insert_scooters(conn, rng, scooters, areas or [TRONDHEIM], booked=bookings)
+        conn.execute("""
+            INSERT INTO scooters_rtree SELECT id, lat, lat, lng, lng FROM scooters WHERE id >= ?
+        """, (first_scooter,))
+
+        first_user = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+        conn.execute("""
+            WITH RECURSIVE seq(id) AS (SELECT ?1 UNION ALL SELECT id + 1 FROM seq WHERE id + 1 < ?1 + ?2)
+            INSERT INTO users (id, username, password, email)
+            SELECT id, 'user' || id, 'password', 'user' || id || '@ntnu.no' FROM seq
+        """, (first_user, users))
+
+        # One booking per booked scooter, each a 15 minute reservation. Rides start
+        # up to 5 minutes after booking. Timestamps are written in the same format
+        # as the app's local times.
+        end = calendar.timegm(SEED_END.timetuple())
+        conn.execute("""
+            WITH RECURSIVE
+                seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < :count),
+                generated AS MATERIALIZED (
+                    SELECT
+                        :first_user + CAST(seeded_random() * :users AS INTEGER) AS user_id,
+                        :first_scooter + i AS scooter_id,
+                        seeded_random() < :pending_share AS pending,
+                        seeded_random() AS age,
+                        CAST(seeded_random() * 300 AS INTEGER) AS start_delay
+                    FROM seq
+                ),
+                dated AS (
+                    SELECT *, CASE
+                        WHEN pending THEN :end - CAST(age * 900 AS INTEGER)
+                        ELSE :end - 300 - CAST(age * 3300 AS INTEGER)
+                    END AS created
+                    FROM generated
+                )
+            INSERT INTO bookings (user_id, scooter_id, status, expires_at, created_at, activated_at)
+            SELECT
+                user_id,
+                scooter_id,
+                CASE WHEN pending THEN 'pending' ELSE 'active' END,
+                datetime(created + 900, 'unixepoch'),
+                datetime(created, 'unixepoch'),
+                CASE WHEN pending THEN NULL ELSE datetime(created + start_delay, 'unixepoch') END
+            FROM dated
+        """, {
+            "count": bookings, "first_user": first_user, "users": users,
+            "first_scooter": first_scooter, "pending_share": PENDING_SHARE, "end": end
+        })
+
+        conn.execute("""
+            WITH RECURSIVE
+                seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < :count),
+                generated AS MATERIALIZED (
+                    SELECT
+                        :first_user + CAST(seeded_random() * :users AS INTEGER) AS user_id,
+                        1 + CAST(seeded_random() * 5 AS INTEGER) AS rating,
+                        CAST(seeded_random() * 4 AS INTEGER) AS comment,
+                        :first_scooter + CAST(seeded_random() * :scooters AS INTEGER) AS scooter_id,
+                        :end - CAST(seeded_random() * 31536000 AS INTEGER) AS created
+                    FROM seq
+                )
+            INSERT INTO feedback (name, email, rating, comments, user_id, scooter_id, created_at)
+            SELECT
+                'user' || user_id,
+                'user' || user_id || '@ntnu.no',
+                rating,
+                CASE comment
+                    WHEN 0 THEN 'Great ride!'
+                    WHEN 1 THEN 'Battery ran out quickly.'
+                    WHEN 2 THEN 'Brakes need a check.'
+                    WHEN 3 THEN 'Smooth and easy.'
+                END,
+                user_id,
+                scooter_id,
+                datetime(created, 'unixepoch')
+            FROM generated
+        """, {
+            "count": feedback, "first_user": first_user, "users": users,
+            "first_scooter": first_scooter, "scooters": scooters, "end": end
+        })
+
+        for _, _, sql in deferred:
+            conn.execute(sql)
+        # The ratings trigger was dropped while inserting feedback
+        rebuild_ratings(conn)
+        conn.execute("ANALYZE")
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    print(f"Seeded {scooters} scooters, {users} users, {bookings} bookings and {feedback} feedback rows")
+
+def parse_area(value: str) -> tuple:
+    """
+    Parse an area given on the command line.
+
+    Args:
+        value (str): "lat,lng,lat_span,lng_span".
+
+    Returns:
+        tuple: The four floats.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not four numbers.
+    """
+    try:
+        area = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        area = ()
+    if len(area) != 4:
+        raise argparse.ArgumentTypeError("an area is lat,lng,lat_span,lng_span")
+    return area
+
+def main():
+    """
+    Create or migrate the database and optionally seed it with generated data.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--scooters", type=int, default=0)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--bookings", type=int, default=0, help="open bookings, at most one per new scooter")
+    parser.add_argument("--feedback", type=int, default=0)
+    parser.add_argument("--area", type=parse_area, action="append", dest="areas",
+                        help="lat,lng,lat_span,lng_span to place scooters in (repeatable, default: Trondheim)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--replace", action="store_true", help="delete existing data other than admins first")
+    parser.add_argument("--rebuild-ratings", action="store_true",
+                        help="recompute the scooter rating aggregates from the feedback table")
+    args = parser.parse_args()
+
+    initialize_database()
+    if args.scooters or args.users or args.bookings or args.feedback or args.replace:
+        seed_database(args.scooters, args.users, args.bookings, args.feedback, args.areas, args.seed, args.replace)
+    if args.rebuild_ratings:
+        with transaction() as conn:
+            rebuild_ratings(conn)
+        print("Rebuilt the scooter rating aggregates")
+
+if __name__ == "__main__":
+    main()
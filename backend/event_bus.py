@@ -0,0 +1,158 @@
+import asyncio
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+# Events held before the backpressure policy applies
+EVENT_QUEUE_SIZE = 10000
+# Events handed to the handler at once
+BATCH_SIZE = 500
+# Seconds a producer waits for space under the "block" policy before dropping
+BLOCK_TIMEOUT = 1.0
+# Lag samples kept for the statistics
+LAG_WINDOW = 1000
+
+# What happens to a new event when the queue is full:
+#   drop_oldest - discard the oldest queued event to make room
+#   drop_newest - discard the new event
+#   block       - wait up to BLOCK_TIMEOUT for room, then discard the new event
+POLICIES = ("drop_oldest", "drop_newest", "block")
+BACKPRESSURE_POLICY = os.environ.get("MQTT_BACKPRESSURE", "drop_oldest")
+
+class EventBus:
+    """
+    A bounded hand-off queue from a producer thread to an asyncio consumer.
+
+    Producers only append to the queue, so they never wait on the database.
+    The consumer runs on the event loop and passes the queued events to the
+    handler coroutine in lists of up to batch_size, so their side effects can
+    be batched too.
+    """
+
+    def __init__(self, handler, maxsize: int = EVENT_QUEUE_SIZE, policy: str = BACKPRESSURE_POLICY,
+                 batch_size: int = BATCH_SIZE):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._loop: asyncio.AbstractEventLoop = None
+        self._wakeup: asyncio.Event = None
+        self._consumer_waiting = False
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.lag = deque(maxlen=LAG_WINDOW)
+
+    def start(self):
+        """
+        Bind the bus to the running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def put(self, event):
+        """
+        Queue an event, applying the backpressure policy if the queue is full.
+        Safe to call from any thread.
+
+        Args:
+            event: The event to queue.
+
+        Returns:
+            bool: True if the event was queued, False if it was dropped.
+        """
+        with self._lock:
+            self.received += 1
+            if len(self._events) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._events.popleft()
+                    self.dropped += 1
+                elif self.policy == "block":
+                    self._not_full.wait_for(lambda: len(self._events) < self.maxsize, BLOCK_TIMEOUT)
+                if len(self._events) >= self.maxsize:
+                    self.dropped += 1
+                    return False
+
+            self._events.append((time.monotonic(), event))
+            self.max_depth = max(self.max_depth, len(self._events))
+            wake, self._consumer_waiting = self._consumer_waiting, False
+
+        if wake and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def _take(self) -> list:
+        """
+        Remove the next batch of events from the queue.
+
+        Returns:
+            list: Up to batch_size (enqueue time, event) pairs, oldest first.
+        """
+        with self._lock:
+            count = min(len(self._events), self.batch_size)
+            batch = [self._events.popleft() for _ in range(count)]
+            if batch:
+                self._not_full.notify_all()
+            else:
+                self._consumer_waiting = True
+            return batch
+
+    async def run(self):
+        """
+        Hand queued events to the handler until cancelled.
+        """
+        while True:
+            self._wakeup.clear()
+            batch = self._take()
+            if not batch:
+                await self._wakeup.wait()
+                continue
+
+            await self._handle(batch)
+
+    async def drain(self):
+        """
+        Hand the events still queued to the handler. Called on shutdown, once
+        run() is cancelled and the producer has stopped.
+        """
+        while batch := self._take():
+            await self._handle(batch)
+
+    async def _handle(self, batch: list):
+        now = time.monotonic()
+        self.lag.extend(now - queued_at for queued_at, _ in batch)
+        try:
+            await self.handler([event for _, event in batch])
+        except Exception as e:
+            print(f"Error handling events: {e}")
+        self.processed += len(batch)
+
+    def stats(self) -> dict:
+        """
+        Summarise the state of the queue.
+
+        Returns:
+            dict: Queue depth, event counters and processing lag in milliseconds.
+        """
+        lag = sorted(self.lag)
+        return {
+            "policy": self.policy,
+            "depth": len(self._events),
+            "max_depth": self.max_depth,
+            "capacity": self.maxsize,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "lag_mean_ms": round(statistics.fmean(lag) * 1000, 2) if lag else 0,
+            "lag_p99_ms": round(lag[min(len(lag) - 1, int(len(lag) * 0.99))] * 1000, 2) if lag else 0,
+            "lag_max_ms": round(lag[-1] * 1000, 2) if lag else 0
+        }
@@ -0,0 +1,214 @@
+import hashlib
+import struct
+import threading
+
+from db import read_connection
+from fleet_stream import fleet_broadcaster
+
+class FleetSnapshot:
+    """
+    In-memory copy of the scooters table with a monotonically increasing version.
+
+    The snapshot is loaded from the database on first use and then patched by
+    every write path through update(), so reads never touch SQLite. ETags for
+    the whole fleet or a single scooter are derived from the records rather
+    than the version, so every worker holding the same fleet hands out the
+    same ETag, and they survive restarts. The fleet's is computed at most
+    once per version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scooters: dict = None
+        self.version = 0
+        self._etag = (None, None)  # The version the fleet ETag was computed at, and the ETag
+        # Called with the deltas of every local change, to share them with other processes
+        self.replicate = None
+
+    def _load(self):
+        """
+        Load every scooter from the database. Must be called with the lock held.
+        """
+        with read_connection() as conn:
+            rows = conn.execute("SELECT id, lat, lng, battery, isBooked, needs_fixing FROM scooters").fetchall()
+        self._scooters = {
+            row[0]: {
+                "id": row[0],
+                "lat": row[1],
+                "lng": row[2],
+                "battery": row[3],
+                "isBooked": row[4],
+                "needsFixing": row[5]
+            }
+            for row in rows
+        }
+
+    def etag(self, scooter: dict = None) -> str:
+        """
+        Build an ETag for the whole fleet or for one scooter.
+
+        Args:
+            scooter (dict): A scooter returned by get(), or None for the fleet.
+
+        Returns:
+            str: The quoted ETag.
+        """
+        if scooter is not None:
+            return f'"{digest([record_key(scooter)])}"'
+
+        with self._lock:
+            if self._scooters is None:
+                self._load()
+            version, etag = self._etag
+            if version == self.version:
+                return etag
+            version = self.version
+            keys = [record_key(self._scooters[scooter_id]) for scooter_id in sorted(self._scooters)]
+        # Hashed outside the lock, so updates are not held up
+        etag = f'"{digest(keys)}"'
+        with self._lock:
+            if self.version == version:
+                self._etag = (version, etag)
+        return etag
+
+    def load(self):
+        """
+        Load the snapshot now, if it is not loaded yet, so changes can be
+        placed on the map as they are published.
+        """
+        with self._lock:
+            if self._scooters is None:
+                self._load()
+
+    def all(self) -> list:
+        """
+        Get every scooter in the fleet.
+
+        Returns:
+            list: Copies of the scooter records.
+        """
+        with self._lock:
+            if self._scooters is None:
+                self._load()
+            return [dict(scooter) for scooter in self._scooters.values()]
+
+    def get(self, scooter_id: int):
+        """
+        Get one scooter.
+
+        Args:
+            scooter_id (int): The ID of the scooter.
+
+        Returns:
+            dict or None: A copy of the scooter record, if it exists.
+        """
+        with self._lock:
+            if self._scooters is None:
+                self._load()
+            scooter = self._scooters.get(scooter_id)
+            return dict(scooter) if scooter else None
+
+    def update(self, scooter_id: int, **changes):
+        """
+        Record a committed change to a scooter and push it to live map clients.
+
+        Args:
+            scooter_id (int): The ID of the scooter.
+            **changes: The changed fields, named as in /scooter-locations.
+        """
+        record = previous = None
+        with self._lock:
+            self.version += 1
+            if self._scooters is not None:
+                scooter = self._scooters.get(scooter_id)
+                if scooter is None:
+                    # Unknown scooter: reload on next read
+                    self._scooters = None
+                else:
+                    previous = (scooter["lat"], scooter["lng"])
+                    scooter.update(changes)
+                    record = dict(scooter)
+        fleet_broadcaster.publish({"id": scooter_id, **changes}, record, previous)
+        if self.replicate is not None:
+            self.replicate([{"id": scooter_id, **changes}])
+
+    def update_many(self, deltas: list, replicate: bool = True):
+        """
+        Record a batch of committed changes and push the ones that changed
+        anything to live map clients in a single event.
+
+        Args:
+            deltas (list): Dicts with the scooter "id" and its changed fields.
+            replicate (bool): Whether to share the changes with other processes.
+                False for changes received from another process.
+        """
+        with self._lock:
+            if self._scooters is not None:
+                changed = []
+                for delta in deltas:
+                    scooter = self._scooters.get(delta["id"])
+                    if scooter is None:
+                        self._scooters = None
+                        changed = deltas
+                        break
+                    if any(scooter.get(key) != value for key, value in delta.items()):
+                        changed.append(delta)
+                deltas = changed
+            if not deltas:
+                return
+            self.version += 1
+            if self._scooters is None:
+                changes = [(delta, None, None) for delta in deltas]
+            else:
+                # Map clients are sent changes by where the scooters were and now are
+                changes = []
+                for delta in deltas:
+                    scooter = self._scooters[delta["id"]]
+                    previous = (scooter["lat"], scooter["lng"])
+                    scooter.update(delta)
+                    changes.append((delta, dict(scooter), previous))
+        fleet_broadcaster.publish_many(changes)
+        if replicate and self.replicate is not None:
+            self.replicate(deltas)
+
+    def invalidate(self):
+        """
+        Drop the snapshot so it is reloaded from the database on next use.
+        """
+        with self._lock:
+            self.version += 1
+            self._scooters = None
+
+# Fields of a scooter record that ETags cover, packed as doubles (NaN for NULL)
+ETAG_FIELDS = ("id", "lat", "lng", "battery", "isBooked", "needsFixing")
+ETAG_RECORD = struct.Struct(f"<{len(ETAG_FIELDS)}d")
+
+def record_key(scooter: dict) -> bytes:
+    """
+    Pack the fields of a scooter record that ETags cover.
+
+    Packing every field as a double means a battery level received as 87 and
+    one loaded from the database as 87.0 give the same ETag.
+
+    Args:
+        scooter (dict): A scooter record.
+
+    Returns:
+        bytes: The packed fields.
+    """
+    return ETAG_RECORD.pack(*(float("nan") if scooter[key] is None else scooter[key] for key in ETAG_FIELDS))
+
+def digest(keys: list) -> str:
+    """
+    Hash packed records into a short ETag value.
+
+    Args:
+        keys (list): The records packed by record_key().
+
+    Returns:
+        str: The hex digest.
+    """
+    return hashlib.blake2b(b"".join(keys), digest_size=8).hexdigest()
+
+# Shared snapshot of the fleet
+fleet_snapshot = FleetSnapshot()
@@ -0,0 +1,177 @@
+import asyncio
+import json
+
+# Events buffered per client before it is considered too slow
+CLIENT_BUFFER_SIZE = 100
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+# Marker telling a client that it missed events and needs a new snapshot
+RESYNC = object()
+
+def format_event(event: str, data) -> str:
+    """
+    Format a server-sent event.
+
+    Args:
+        event (str): The event name.
+        data: The JSON-serialisable event data.
+
+    Returns:
+        str: The encoded event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def format_deltas(deltas: list) -> str:
+    """
+    Format scooter changes as a "delta" event, or a "deltas" event for several.
+
+    Args:
+        deltas (list): Dicts with the scooter "id" and its changed fields.
+
+    Returns:
+        str: The encoded event.
+    """
+    return format_event("delta", deltas[0]) if len(deltas) == 1 else format_event("deltas", deltas)
+
+def in_viewport(viewport: tuple, lat: float, lng: float) -> bool:
+    """
+    Check whether a position lies inside a viewport.
+
+    Args:
+        viewport (tuple): The (west, south, east, north) coordinates.
+        lat (float): The latitude, or None if unknown.
+        lng (float): The longitude, or None if unknown.
+
+    Returns:
+        bool: True if the position is inside the viewport.
+    """
+    west, south, east, north = viewport
+    return lat is not None and lng is not None and south <= lat <= north and west <= lng <= east
+
+def visible_deltas(changes: list, viewport: tuple) -> list:
+    """
+    Pick the changes a client watching a viewport needs.
+
+    A scooter that moved into the viewport is sent whole, as the client has
+    no marker for it yet. One that moved out is sent its change, so the
+    client can remove it. Changes whose position is unknown are sent as they
+    are.
+
+    Args:
+        changes (list): (delta, scooter, previous) tuples, as given to publish_many().
+        viewport (tuple): The (west, south, east, north) coordinates.
+
+    Returns:
+        list: The deltas to send.
+    """
+    visible = []
+    for delta, scooter, previous in changes:
+        if scooter is None:
+            visible.append(delta)
+            continue
+        inside = in_viewport(viewport, scooter["lat"], scooter["lng"])
+        was_inside = previous is not None and in_viewport(viewport, *previous)
+        if inside and not was_inside:
+            visible.append(scooter)
+        elif inside or was_inside:
+            visible.append(delta)
+    return visible
+
+class FleetBroadcaster:
+    """
+    Fans out scooter state changes to the connected map clients.
+
+    A client watching a viewport only gets the changes to scooters inside it,
+    or moving into or out of it; clients watching the whole fleet share one
+    encoded event. Events are pushed to a bounded queue per client. A client
+    that falls behind has its backlog dropped and is sent a fresh snapshot
+    instead, so a slow client never holds up the others.
+    """
+
+    def __init__(self, buffer_size: int = CLIENT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._clients = {}  # Queue -> the viewport the client watches, None for the whole fleet
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def start(self):
+        """
+        Bind the broadcaster to the running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+
+    def subscribe(self, viewport: tuple = None) -> asyncio.Queue:
+        """
+        Register a new client.
+
+        Args:
+            viewport (tuple): The (west, south, east, north) coordinates the
+                client shows, or None for the whole fleet.
+
+        Returns:
+            asyncio.Queue: The queue the client's events are delivered to.
+        """
+        queue = asyncio.Queue(maxsize=self.buffer_size)
+        self._clients[queue] = viewport
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        """
+        Remove a client.
+
+        Args:
+            queue (asyncio.Queue): The queue returned by subscribe().
+        """
+        self._clients.pop(queue, None)
+
+    def publish(self, delta: dict, scooter: dict = None, previous: tuple = None):
+        """
+        Send a change of a scooter's state to the clients it concerns. Safe to call from any thread.
+
+        Args:
+            delta (dict): The scooter "id" and its changed fields, named as in /scooter-locations.
+            scooter (dict): The scooter's full record after the change, if known.
+            previous (tuple): Its (lat, lng) before the change, if known.
+        """
+        self.publish_many([(delta, scooter, previous)])
+
+    def publish_many(self, changes: list):
+        """
+        Send a batch of scooter changes to the clients they concern, as a
+        single event per client. Safe to call from any thread.
+
+        Args:
+            changes (list): (delta, scooter, previous) tuples, as for publish().
+        """
+        if self._loop is None or not changes:
+            return
+        self._loop.call_soon_threadsafe(self._fan_out, changes)
+
+    def _fan_out(self, changes: list):
+        """
+        Queue the changes each client needs.
+
+        Args:
+            changes (list): (delta, scooter, previous) tuples.
+        """
+        everything = None
+        for queue, viewport in self._clients.items():
+            if viewport is None:
+                if everything is None:
+                    everything = format_deltas([delta for delta, _, _ in changes])
+                event = everything
+            else:
+                deltas = visible_deltas(changes, viewport)
+                if not deltas:
+                    continue
+                event = format_deltas(deltas)
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Drop the backlog and let the client start over from a snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+# Shared broadcaster for all map clients
+fleet_broadcaster = FleetBroadcaster()
@@ -0,0 +1,50 @@
+import asyncio
+import statistics
+from collections import deque
+
+# Seconds between lag probes
+PROBE_INTERVAL = 0.05
+# Probes kept for the statistics (one minute at the default interval)
+PROBE_WINDOW = 1200
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a short sleep.
+
+    Any time the loop spends blocked (e.g. on a synchronous database call in
+    an async handler) shows up directly as lag.
+    """
+
+    def __init__(self, interval: float = PROBE_INTERVAL, window: int = PROBE_WINDOW):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+
+    async def run(self):
+        """
+        Probe the event loop until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - start - self.interval, 0))
+
+    def stats(self) -> dict:
+        """
+        Summarise the recent lag samples.
+
+        Returns:
+            dict: Sample count and mean, p99 and max lag in milliseconds.
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "mean_ms": 0, "p99_ms": 0, "max_ms": 0}
+        return {
+            "samples": len(samples),
+            "mean_ms": round(statistics.fmean(samples) * 1000, 2),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+            "max_ms": round(samples[-1] * 1000, 2)
+        }
+
+# Shared monitor for the app's event loop
+loop_lag_monitor = LoopLagMonitor()
@@ -1,18 +1,30 @@
-import secrets
+import asyncio
+import hashlib
+import time
 from datetime import datetime, timedelta
+from urllib.parse import urlencode
 
 import pytz
-import sqlite3
 import uvicorn
-from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, Form, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from itsdangerous import URLSafeSerializer
 
-from db_setup import initialize_database, DATABASE
-from scheduled_task import lifespan
-from mqtt_handler import send_command
+from booking_search import MAX_PAGE_SIZE, PAGE_SIZE, STATUSES, bookings_page, parse_filters
+from booking_state import ACTIVATING, ACTIVE, PENDING, STOPPING, transition
+from db import read_connection, run_blocking, run_read, run_write
+from db_setup import initialize_database, recover_bookings
+from exports import EXPORTS, FORMATS, export_table
+from fleet_snapshot import fleet_snapshot
+from fleet_stream import KEEPALIVE_INTERVAL, RESYNC, fleet_broadcaster, format_event
+from loop_lag import loop_lag_monitor
+from ratings import ROLLING_DAYS, STARS, scooter_ratings
+from spatial import CLUSTER_MAX_ZOOM, clusters_in_bbox, nearest_available, parse_bbox, scooters_in_bbox
+from scheduled_task import expiry_scheduler, lifespan
+from sessions import SESSION_MAX_AGE, session_manager
+from timeseries import telemetry_history
+from mqtt_handler import mqtt_event_bus, send_command
 
 TIMEZONE = pytz.timezone("Europe/Oslo")
 
@@ -31,17 +43,29 @@ def capitalize(value: str) -> str:
 templates.env.filters['datetimeformat'] = datetimeformat
 templates.env.filters['capitalize'] = capitalize
 
-# Session setup using itsdangerous
-SECRET_KEY = secrets.token_urlsafe(32)
-serializer = URLSafeSerializer(SECRET_KEY)
+def ride_charges(activated_at: str, stopped_at: str, parking: str) -> tuple:
+    """
+    Calculate what a ride costs.
+
+    Args:
+        activated_at (str): When the ride started.
+        stopped_at (str): When the ride ended.
+        parking (str): The status the scooter parked with.
+
+    Returns:
+        tuple: The duration in seconds, the ride cost and the parking fee in NOK.
+    """
+    started = TIMEZONE.localize(datetime.strptime(activated_at, "%Y-%m-%d %H:%M:%S"))
+    stopped = TIMEZONE.localize(datetime.strptime(stopped_at, "%Y-%m-%d %H:%M:%S"))
+    duration = (stopped - started).total_seconds()
+    cost = duration // 60 * 2.5 + 2.5
+    parking_fee = 10 if parking == "parked_increased_fare" else 0
+    return duration, cost, parking_fee
 
 def get_session(request: Request):
     session_token = request.cookies.get("session")
     if session_token:
-        try:
-            return serializer.loads(session_token)
-        except Exception:
-            return {}
+        return session_manager.loads(session_token)
     return {}
 
 ### MAIN PAGE ###
@@ -65,7 +89,8 @@ def read_root(request: Request):
     response = templates.TemplateResponse("index.html", {
         "request": request,
         "session": session,
-        "error": error
+        "error": error,
+        "cluster_max_zoom": CLUSTER_MAX_ZOOM
     })
 
     # Clear the error cookie after retrieving it
@@ -73,18 +98,62 @@ def read_root(request: Request):
 
     return response
 
-@app.get("/scooter-locations")
-def get_markers():
+def is_not_modified(request: Request, etag: str) -> bool:
     """
-    Retrieve scooter locations.
+    Check whether a conditional GET already has the current representation.
+
+    Args:
+        request (Request): The HTTP request object.
+        etag (str): The current ETag.
 
     Returns:
-        JSONResponse: A list of scooter locations.
+        bool: True if the client's If-None-Match matches the ETag.
     """
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, lat, lng, isBooked, needs_fixing FROM scooters")
-    data = [
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def conditional_response(request: Request, response: Response) -> Response:
+    """
+    Tag a response with an ETag hashed from its body.
+
+    Args:
+        request (Request): The HTTP request object.
+        response (Response): The full response.
+
+    Returns:
+        Response: The response, or a 304 if the client already has it.
+    """
+    etag = f'"{hashlib.blake2b(response.body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+def scooter_markers(viewport: tuple = None):
+    """
+    Get the map markers of all scooters, or of those inside a viewport.
+
+    The whole fleet is served from the in-memory snapshot; viewports are
+    looked up in the spatial index.
+
+    Args:
+        viewport (tuple): The (west, south, east, north) coordinates, if any.
+
+    Returns:
+        list: The scooter markers.
+    """
+    if viewport is None:
+        return [
+            {key: scooter[key] for key in ("id", "lat", "lng", "isBooked", "needsFixing")}
+            for scooter in fleet_snapshot.all()
+        ]
+
+    with read_connection() as conn:
+        rows = scooters_in_bbox(conn, viewport)
+    return [
         {
             "id": row[0],
             "lat": row[1],
@@ -92,41 +161,161 @@ def get_markers():
             "isBooked": row[3],
             "needsFixing": row[4]
         }
-        for row in cursor.fetchall()
+        for row in rows
     ]
-    conn.close()
-    return JSONResponse(content=data)
+
+@app.get("/scooter-locations")
+def get_markers(request: Request, bbox: str = None, zoom: int = None):
+    """
+    Retrieve scooter locations, optionally limited to a map viewport.
+
+    Below CLUSTER_MAX_ZOOM, nearby scooters are merged into clusters carrying
+    a count instead of being returned one by one. Responses carry an ETag
+    derived from their content, so repeated polls of an unchanged fleet get a
+    304 whichever worker answers them. The whole fleet's comes from the
+    snapshot; viewports are hashed once they are read from the database.
+
+    Args:
+        request (Request): The HTTP request object.
+        bbox (str): The viewport as "west,south,east,north".
+        zoom (int): The map zoom level.
+
+    Returns:
+        JSONResponse: A list of scooter locations and clusters.
+    """
+    if bbox is None:
+        # Read the ETag first: a change while the markers are copied only makes it stale
+        etag = fleet_snapshot.etag()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=scooter_markers(), headers=headers)
+
+    try:
+        viewport = parse_bbox(bbox)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    if zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+        with read_connection() as conn:
+            cells = clusters_in_bbox(conn, viewport, zoom)
+        data = [
+            {"id": cell[3], "lat": cell[1], "lng": cell[2], "isBooked": cell[4], "needsFixing": 0}
+            if cell[0] == 1 else
+            {"cluster": True, "count": cell[0], "lat": cell[1], "lng": cell[2]}
+            for cell in cells
+        ]
+        return conditional_response(request, JSONResponse(content=data))
+
+    return conditional_response(request, JSONResponse(content=scooter_markers(viewport)))
+
+@app.get("/scooter-stream")
+async def scooter_stream(request: Request, bbox: str = None):
+    """
+    Stream live scooter updates as server-sent events.
+
+    The stream starts with a "snapshot" event holding the markers in the
+    viewport (or the whole fleet), followed by "delta" and "deltas" events
+    for the changes to scooters in it. Scooters moving into the viewport are
+    sent whole; those moving out are sent their new position. A new snapshot
+    is sent if the client falls behind.
+
+    Args:
+        request (Request): The HTTP request object.
+        bbox (str): The viewport as "west,south,east,north".
+
+    Returns:
+        StreamingResponse: The event stream or an error message.
+    """
+    try:
+        viewport = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    async def events():
+        if viewport is not None:
+            # Changes are placed in the viewport by the snapshot's positions
+            await run_blocking(fleet_snapshot.load)
+        queue = fleet_broadcaster.subscribe(viewport)
+        try:
+            yield format_event("snapshot", await run_blocking(scooter_markers, viewport))
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is RESYNC:
+                    event = format_event("snapshot", await run_blocking(scooter_markers, viewport))
+                yield event
+        finally:
+            fleet_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/scooter-data")
-def get_marker_info(id: int):
+def get_marker_info(request: Request, id: int):
     """
     Retrieve detailed information about a specific scooter.
 
     Args:
+        request (Request): The HTTP request object.
         id (int): The ID of the scooter.
 
     Returns:
         JSONResponse: Scooter details or an error message.
     """
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM scooters WHERE id = ?", (id,))
-    row = cursor.fetchone()
-    conn.close()
+    row = fleet_snapshot.get(id)
 
     if row:
+        etag = fleet_snapshot.etag(row)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
         scooter = {
+            "id": row["id"],
+            "lat": row["lat"],
+            "lng": row["lng"],
+            "battery": row["battery"],
+            "isBooked": bool(row["isBooked"])
+        }
+        return JSONResponse(content=scooter, headers=headers)
+    return JSONResponse(content={"error": "Scooter not found"}, status_code=404)
+
+@app.get("/nearest-scooters")
+def get_nearest_scooters(lat: float, lng: float, k: int = 5, min_battery: int = 20):
+    """
+    Retrieve the nearest scooters that are available for booking.
+
+    Args:
+        lat (float): Latitude of the search point.
+        lng (float): Longitude of the search point.
+        k (int): The number of scooters to return (at most 50).
+        min_battery (int): The minimum battery level in percent.
+
+    Returns:
+        JSONResponse: A list of scooters ordered by distance, or an error message.
+    """
+    if not 1 <= k <= 50:
+        return JSONResponse(content={"error": "k must be between 1 and 50"}, status_code=400)
+
+    with read_connection() as conn:
+        rows = nearest_available(conn, lat, lng, k, min_battery)
+    data = [
+        {
             "id": row[0],
             "lat": row[1],
             "lng": row[2],
             "battery": row[3],
-            "isBooked": bool(row[4])
+            "distance": round(row[4])
         }
-        return JSONResponse(content=scooter)
-    return JSONResponse(content={"error": "Scooter not found"}, status_code=404)
+        for row in rows
+    ]
+    return JSONResponse(content=data)
 
 @app.post("/book-scooter")
-def book_scooter(request: Request, scooter_id: int = Form(...)):
+async def book_scooter(request: Request, scooter_id: int = Form(...)):
     """
     Book a scooter.
 
@@ -142,37 +331,40 @@ def book_scooter(request: Request, scooter_id: int = Form(...)):
         return RedirectResponse("/login", status_code=303)
 
     user_id = session["user_id"]
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    # Ensure the scooter is not already booked
-    cursor.execute("SELECT isBooked FROM scooters WHERE id = ?", (scooter_id,))
-    row = cursor.fetchone()
-    if not row or row[0]:
-        conn.close()
-        response = RedirectResponse("/", status_code=303)
-        response.set_cookie("booking_error", "Scooter is already booked")
-        return response
 
-    # Mark the scooter as booked and create a pending booking
+    # Mark the scooter as booked and create a pending booking. The conditional
+    # update makes sure only one of several concurrent requests gets the scooter.
     created_at = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
     expires_at = (datetime.now(TIMEZONE) + timedelta(minutes=15)).strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("UPDATE scooters SET isBooked = 1 WHERE id = ?", (scooter_id,))
-        cursor.execute("""
+
+    def claim(conn):
+        claimed = conn.execute("""
+            UPDATE scooters SET isBooked = 1
+            WHERE id = ? AND isBooked = 0 AND needs_fixing = 0
+        """, (scooter_id,)).rowcount
+        if not claimed:
+            return None
+        return conn.execute("""
             INSERT INTO bookings (user_id, scooter_id, status, expires_at, created_at)
             VALUES (?, ?, 'pending', ?, ?)
-        """, (user_id, scooter_id, expires_at, created_at))
-        conn.commit()
+        """, (user_id, scooter_id, expires_at, created_at)).lastrowid
+
+    try:
+        # Queued on the database writer thread with every other write
+        booking_id = await run_write(claim)
     except Exception as e:
-        conn.rollback()
-        conn.close()
         response = RedirectResponse("/", status_code=303)
         response.set_cookie("booking_error", "Failed to book scooter")
         return response
 
-    conn.close()
+    if booking_id is None:
+        response = RedirectResponse("/", status_code=303)
+        response.set_cookie("booking_error", "Scooter is already booked")
+        return response
+
+    # Release the booking automatically when it expires
+    expiry_scheduler.schedule(booking_id, expires_at)
+    fleet_snapshot.update(scooter_id, isBooked=1)
     return RedirectResponse("/bookings", status_code=303)
 
 ### LOGIN/REGISTER ###
@@ -214,16 +406,15 @@ def login(username: str = Form(...), password: str = Form(...)):
     Returns:
         RedirectResponse: Redirects to the main page or the login page with an error.
     """
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, is_admin FROM users WHERE username = ? AND password = ?", (username, password))
-    user = cursor.fetchone()
-    conn.close()
+    with read_connection() as conn:
+        user = conn.execute(
+            "SELECT id, is_admin FROM users WHERE username = ? AND password = ?", (username, password)
+        ).fetchone()
 
     if user:
-        session_token = serializer.dumps({"username": username, "user_id": user[0], "is_admin": bool(user[1])})
+        session_token = session_manager.dumps({"username": username, "user_id": user[0], "is_admin": bool(user[1])})
         response = RedirectResponse("/", status_code=303)
-        response.set_cookie("session", session_token)
+        response.set_cookie("session", session_token, max_age=SESSION_MAX_AGE, httponly=True, samesite="lax")
         return response
 
     # Redirect to the login page and set an error message in a cookie
@@ -258,7 +449,7 @@ def register_page(request: Request):
     return response
 
 @app.post("/register")
-def register(
+async def register(
     username: str = Form(...),
     password: str = Form(...),
     email: str = Form(...)
@@ -274,42 +465,46 @@ def register(
     Returns:
         RedirectResponse: Redirects to the login page or the registration page with an error.
     """
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    def create_user(conn):
+        # Check for duplicate username
+        if conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone():
+            return "Username already exists"
+        # Check for duplicate email
+        if conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone():
+            return "Email already exists"
+        # Insert new user
+        conn.execute("""
+            INSERT INTO users (username, password, email)
+            VALUES (?, ?, ?)
+        """, (username, password, email))
+        return None
 
-    # Check for duplicate username
-    cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-    if cursor.fetchone():
-        conn.close()
-        response = RedirectResponse("/register", status_code=303)
-        response.set_cookie("register_error", "Username already exists")
-        return response
+    try:
+        error = await run_write(create_user)
+    except Exception as e:
+        print(f"Error registering user: {e}")
+        error = "Registration failed, please try again"
 
-    # Check for duplicate email
-    cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
-    if cursor.fetchone():
-        conn.close()
+    if error:
         response = RedirectResponse("/register", status_code=303)
-        response.set_cookie("register_error", "Email already exists")
+        response.set_cookie("register_error", error)
         return response
-
-    # Insert new user
-    cursor.execute("""
-        INSERT INTO users (username, password, email)
-        VALUES (?, ?, ?)
-    """, (username, password, email))
-    conn.commit()
-    conn.close()
     return RedirectResponse("/login", status_code=303)
 
 @app.get("/logout")
-def logout():
+def logout(request: Request):
     """
     Handle user logout.
 
+    Args:
+        request (Request): The HTTP request object.
+
     Returns:
         RedirectResponse: Redirects to the main page.
     """
+    session_token = request.cookies.get("session")
+    if session_token:
+        session_manager.forget(session_token)
     response = RedirectResponse("/", status_code=303)
     response.delete_cookie("session")
     return response
@@ -329,11 +524,21 @@ def get_feedback(request: Request):
     session = get_session(request)
     if not session:
         return RedirectResponse("/login", status_code=303)
-    return templates.TemplateResponse("feedback.html", {
+
+    # Retrieve the error message from the cookie (if it exists)
+    error = request.cookies.get("feedback_error")
+
+    response = templates.TemplateResponse("feedback.html", {
         "request": request,
-        "session": session
+        "session": session,
+        "error": error
     })
 
+    # Clear the error cookie after retrieving it
+    response.delete_cookie("feedback_error")
+
+    return response
+
 @app.post("/feedback")
 def post_feedback(request: Request, scooter_id: int = Form(None)):
     """
@@ -356,7 +561,7 @@ def post_feedback(request: Request, scooter_id: int = Form(None)):
     })
 
 @app.post("/submit-feedback")
-def submit_feedback(
+async def submit_feedback(
     request: Request,
     name: str = Form(...), 
     email: str = Form(...), 
@@ -382,25 +587,44 @@ def submit_feedback(
     if not session:
         return RedirectResponse("/login", status_code=303)
 
+    # The rating aggregates only count whole stars
+    if rating not in STARS:
+        response = RedirectResponse("/feedback", status_code=303)
+        response.set_cookie("feedback_error", "Rating must be between 1 and 5")
+        return response
+
     user_id = session["user_id"]
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO feedback (name, email, rating, comments, user_id, scooter_id)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (name, email, rating, comments, user_id, scooter_id))
-    conn.commit()
-    conn.close()
+    created_at = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    # The scooter's rating aggregates are updated by a trigger in the same transaction
+    try:
+        await run_write(lambda conn: conn.execute("""
+            INSERT INTO feedback (name, email, rating, comments, user_id, scooter_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (name, email, rating, comments, user_id, scooter_id, created_at)))
+    except Exception as e:
+        print(f"Error saving feedback: {e}")
+        response = RedirectResponse("/feedback", status_code=303)
+        response.set_cookie("feedback_error", "Failed to submit feedback, please try again")
+        return response
     return RedirectResponse("/", status_code=303)
 
 ### BOOKINGS ###
 @app.get("/bookings")
-def view_bookings(request: Request):
+def view_bookings(request: Request, status: str = None, user: str = None, scooter: str = None,
+                  start: str = None, end: str = None, cursor: str = None):
     """
     Render the bookings page.
 
+    Admins see every booking, a page at a time, and can filter them.
+
     Args:
         request (Request): The HTTP request object.
+        status (str): Admin filter: only bookings in this state.
+        user (str): Admin filter: only bookings of this username.
+        scooter (str): Admin filter: only bookings of this scooter ID.
+        start (str): Admin filter: only bookings created at or after this time.
+        end (str): Admin filter: only bookings created before this time.
+        cursor (str): Admin: the page to show, from the previous page's "Next" link.
 
     Returns:
         TemplateResponse: The rendered bookings page.
@@ -409,59 +633,54 @@ def view_bookings(request: Request):
     if not session:
         return RedirectResponse("/login", status_code=303)
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    if session.get("is_admin"):
-        # Fetch all bookings with usernames for admin
-        cursor.execute("""
-            SELECT b.id, b.scooter_id, b.status, b.expires_at, s.battery, u.username
-            FROM bookings b
-            JOIN scooters s ON b.scooter_id = s.id
-            JOIN users u ON b.user_id = u.id
-        """)
-        bookings = [
-            {
-                "id": row[0],
-                "scooter_id": row[1],
-                "status": row[2],
-                "expires_at": row[3],
-                "battery": row[4],
-                "username": row[5]
-            }
-            for row in cursor.fetchall()
-        ]
-    else:
-        # Fetch bookings for the logged-in user
-        user_id = session["user_id"]
-        cursor.execute("""
-            SELECT b.id, b.scooter_id, b.status, b.expires_at, s.battery
-            FROM bookings b
-            JOIN scooters s ON b.scooter_id = s.id
-            WHERE b.user_id = ?
-        """, (user_id,))
-        bookings = [
-            {
-                "id": row[0],
-                "scooter_id": row[1],
-                "status": row[2],
-                "expires_at": row[3],
-                "battery": row[4]
-            }
-            for row in cursor.fetchall()
-        ]
-
-    conn.close()
-
     # Retrieve the error message from the cookie (if it exists)
     error = request.cookies.get("bookings_error")
+    first_page = next_page = None
+
+    with read_connection() as conn:
+        if session.get("is_admin"):
+            # Fetch one page of bookings with usernames for admin
+            try:
+                filters = parse_filters(status, user, scooter, start, end)
+                bookings, next_cursor = bookings_page(conn, filters, cursor)
+            except ValueError as e:
+                bookings, next_cursor, error = [], None, str(e)
+            # Links to the first and next page keep the filters
+            query = {key: value for key, value in request.query_params.items() if value and key != "cursor"}
+            if cursor:
+                first_page = "/bookings?" + urlencode(query)
+            if next_cursor:
+                next_page = "/bookings?" + urlencode({**query, "cursor": next_cursor})
+        else:
+            # Fetch bookings for the logged-in user
+            user_id = session["user_id"]
+            rows = conn.execute("""
+                SELECT b.id, b.scooter_id, b.status, b.expires_at, s.battery
+                FROM bookings b
+                JOIN scooters s ON b.scooter_id = s.id
+                WHERE b.user_id = ?
+            """, (user_id,)).fetchall()
+            bookings = [
+                {
+                    "id": row[0],
+                    "scooter_id": row[1],
+                    "status": row[2],
+                    "expires_at": row[3],
+                    "battery": row[4]
+                }
+                for row in rows
+            ]
 
     # Render the bookings page with the error message
     response = templates.TemplateResponse("bookings.html", {
         "request": request,
         "bookings": bookings,
         "session": session,
-        "error": error
+        "error": error,
+        "filters": {"status": status, "user": user, "scooter": scooter, "start": start, "end": end},
+        "statuses": STATUSES,
+        "first_page": first_page,
+        "next_page": next_page
     })
 
     # Clear the error cookie after retrieving it
@@ -486,17 +705,13 @@ async def activate_booking(request: Request, booking_id: int = Form(...)):
         return RedirectResponse("/login", status_code=303)
 
     user_id = session["user_id"]
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
 
     # Activate the booking if it is still valid
-    cursor.execute("""
+    booking = await run_read(lambda conn: conn.execute("""
         SELECT expires_at, scooter_id FROM bookings
         WHERE id = ? AND user_id = ? AND status = 'pending'
-    """, (booking_id, user_id))
-    booking = cursor.fetchone()
+    """, (booking_id, user_id)).fetchone())
     if not booking:
-        conn.close()
         response = RedirectResponse("/bookings", status_code=303)
         response.set_cookie("bookings_error", "Booking not found")
         return response
@@ -507,33 +722,37 @@ async def activate_booking(request: Request, booking_id: int = Form(...)):
 
     # Compare expires_at with the current time
     if expires_at < activated_at:
-        conn.close()
         response = RedirectResponse("/bookings", status_code=303)
         response.set_cookie("bookings_error", "Booking has expired or is invalid")
         return response
 
+    # Claim the booking so it cannot be activated twice, cancelled or expired meanwhile
+    if not await run_write(transition, booking_id, PENDING, ACTIVATING, user_id):
+        response = RedirectResponse("/bookings", status_code=303)
+        response.set_cookie("bookings_error", "Booking not found")
+        return response
+
     try:
-        cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("""
-            UPDATE bookings
-            SET status = 'active', activated_at = ?
-            WHERE id = ?
-        """, (activated_at.strftime("%Y-%m-%d %H:%M:%S"), booking_id))
-
-        # Send MQTT start command
+        # Send MQTT start command, outside of any transaction
         response = await send_command(scooter_id, "start")
         if response != "activated":
             raise Exception("Failed to activate scooter via MQTT")
-        
-        conn.commit()
     except Exception as e:
-        conn.rollback()
-        conn.close()
+        # Hand the booking back so it can be retried or expire, unless a collision ended it meanwhile
+        if await run_write(transition, booking_id, ACTIVATING, PENDING):
+            expiry_scheduler.schedule(booking_id, booking[0])
         response = RedirectResponse("/bookings", status_code=303)
         response.set_cookie("bookings_error", str(e))
         return response
 
-    conn.close()
+    activated = await run_write(lambda conn: transition(
+        conn, booking_id, ACTIVATING, ACTIVE, activated_at=activated_at.strftime("%Y-%m-%d %H:%M:%S")
+    ))
+    if not activated:
+        # A collision reported while the scooter was starting ended the booking
+        response = RedirectResponse("/bookings", status_code=303)
+        response.set_cookie("bookings_error", "The booking ended while the scooter was starting")
+        return response
     return RedirectResponse("/bookings", status_code=303)
 
 @app.post("/delete-booking")
@@ -553,17 +772,13 @@ async def delete_booking(request: Request, booking_id: int = Form(...)):
         return RedirectResponse("/login", status_code=303)
 
     user_id = session["user_id"]
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
 
     # Fetch booking details
-    cursor.execute("""
+    booking = await run_read(lambda conn: conn.execute("""
         SELECT scooter_id, status, activated_at FROM bookings
         WHERE id = ? AND user_id = ?
-    """, (booking_id, user_id))
-    booking = cursor.fetchone()
+    """, (booking_id, user_id)).fetchone())
     if not booking:
-        conn.close()
         response = RedirectResponse("/bookings", status_code=303)
         response.set_cookie("bookings_error", "Booking not found")
         return response
@@ -573,40 +788,67 @@ async def delete_booking(request: Request, booking_id: int = Form(...)):
     # Boolean to check if the ride was finished
     ride_finished = False
 
-    try:
-        cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-        cursor.execute("UPDATE scooters SET isBooked = 0 WHERE id = ?", (scooter_id,))
-
-        # Send MQTT stop command if the booking was active
-        if status == "active":
-            response = await send_command(scooter_id, "stop")
-            print(f"Response from MQTT: {response}")
-            if response not in ("parked_normal_fare", "parked_increased_fare"):
-                raise Exception("Failed to stop scooter via MQTT")
-            ride_finished = True
-            
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        conn.close()
+    def remove_booking(conn, expected_status):
+        removed = conn.execute(
+            "DELETE FROM bookings WHERE id = ? AND status = ?", (booking_id, expected_status)
+        ).rowcount
+        if removed:
+            conn.execute("UPDATE scooters SET isBooked = 0 WHERE id = ?", (scooter_id,))
+        return removed
+
+    if status == PENDING:
+        # Cancel the booking unless it was activated or expired meanwhile
+        removed = await run_write(remove_booking, PENDING)
+    elif status == ACTIVE:
+        # Claim the ride so it cannot be stopped twice
+        if not await run_write(transition, booking_id, ACTIVE, STOPPING, user_id):
+            removed = False
+        else:
+            try:
+                # Send MQTT stop command, outside of any transaction
+                response = await send_command(scooter_id, "stop")
+                print(f"Response from MQTT: {response}")
+                if response not in ("parked_normal_fare", "parked_increased_fare"):
+                    raise Exception("Failed to stop scooter via MQTT")
+            except Exception as e:
+                # The ride goes on
+                await run_write(transition, booking_id, STOPPING, ACTIVE)
+                response = RedirectResponse("/bookings", status_code=303)
+                response.set_cookie("bookings_error", str(e))
+                return response
+
+            stopped_at = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+            duration, cost, parking_fee = ride_charges(activated_at, stopped_at, response)
+
+            def finish_ride(conn) -> bool:
+                # A collision may have ended the ride in the meantime
+                if not remove_booking(conn, STOPPING):
+                    return False
+                conn.execute("""
+                    INSERT INTO rides (user_id, scooter_id, started_at, ended_at, cost, parking_fee)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (user_id, scooter_id, activated_at, stopped_at, cost, parking_fee))
+                return True
+
+            if not await run_write(finish_ride):
+                response = RedirectResponse("/bookings", status_code=303)
+                response.set_cookie("bookings_error", "The ride was already ended by a collision")
+                return response
+            removed = ride_finished = True
+    else:
+        removed = False
+
+    if not removed:
         response = RedirectResponse("/bookings", status_code=303)
-        response.set_cookie("bookings_error", str(e))
+        response.set_cookie("bookings_error", "Booking is being updated, please try again")
         return response
 
-    conn.close()
+    fleet_snapshot.update(scooter_id, isBooked=0)
 
     # If the ride was active, calculate receipt details and render a form to submit to /receipt
     if status == "active" and ride_finished:
-        activated_at = TIMEZONE.localize(datetime.strptime(activated_at, "%Y-%m-%d %H:%M:%S"))
-        stopped_at = TIMEZONE.localize(datetime.strptime(datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S"))
-        duration_minutes = (stopped_at - activated_at).total_seconds() // 60
-        duration_seconds = (stopped_at - activated_at).total_seconds() % 60
-        cost = duration_minutes * 2.5 + 2.5
-        parking_fee = 0
-
-        if response == "parked_increased_fare":
-            parking_fee = 10
+        duration_minutes = duration // 60
+        duration_seconds = duration % 60
 
         # Render a form to submit the receipt data
         html_content = f"""
@@ -678,14 +920,13 @@ def scooters_needing_fix(request: Request):
     if not session or not session.get("is_admin"):
         return RedirectResponse("/", status_code=303)
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, lat, lng, battery FROM scooters WHERE needs_fixing = 1")
+    with read_connection() as conn:
+        rows = conn.execute("SELECT id, lat, lng, battery FROM scooters WHERE needs_fixing = 1").fetchall()
+        ratings = scooter_ratings(conn, [row[0] for row in rows])
     scooters = [
-        {"id": row[0], "lat": row[1], "lng": row[2], "battery": row[3]}
-        for row in cursor.fetchall()
+        {"id": row[0], "lat": row[1], "lng": row[2], "battery": row[3], "rating": ratings.get(row[0])}
+        for row in rows
     ]
-    conn.close()
 
     # Retrieve the error message from the cookie (if it exists)
     error = request.cookies.get("maintenance_error")
@@ -719,29 +960,173 @@ async def fix_scooter(request: Request, scooter_id: int = Form(...)):
     if not session or not session.get("is_admin"):
         return RedirectResponse("/", status_code=303)
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("UPDATE scooters SET needs_fixing = 0 WHERE id = ?", (scooter_id,))
-
+        # Send the command before writing, so no transaction is held while waiting for the reply
         result = await send_command(scooter_id, "service_checked")
         if result != "parked":
             raise Exception("Failed to send service_checked command via MQTT")
-    
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        conn.close()
 
+        await run_write(lambda conn: conn.execute("UPDATE scooters SET needs_fixing = 0 WHERE id = ?", (scooter_id,)))
+    except Exception as e:
         response = RedirectResponse("/admin/maintenance", status_code=303)
         response.set_cookie("maintenance_error", str(e))
         return response
-    
-    conn.close()
+
+    fleet_snapshot.update(scooter_id, needsFixing=0)
     return RedirectResponse("/admin/maintenance", status_code=303)
 
+@app.get("/admin/bookings")
+def admin_bookings(request: Request, status: str = None, user: str = None, scooter: str = None,
+                   start: str = None, end: str = None, cursor: str = None, limit: int = PAGE_SIZE):
+    """
+    Retrieve one page of bookings, newest first.
+
+    Args:
+        request (Request): The HTTP request object.
+        status (str): Only bookings in this state.
+        user (str): Only bookings of this username.
+        scooter (str): Only bookings of this scooter ID.
+        start (str): Only bookings created at or after this time.
+        end (str): Only bookings created before this time.
+        cursor (str): The page to fetch, from the previous page's next_cursor.
+        limit (int): The maximum number of bookings on the page.
+
+    Returns:
+        JSONResponse: The bookings and the cursor of the next page (null on the last page), or an error message.
+    """
+    session = get_session(request)
+    if not session or not session.get("is_admin"):
+        return JSONResponse(content={"error": "Admin access required"}, status_code=403)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return JSONResponse(content={"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}, status_code=400)
+
+    try:
+        filters = parse_filters(status, user, scooter, start, end)
+        with read_connection() as conn:
+            bookings, next_cursor = bookings_page(conn, filters, cursor, limit)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    return JSONResponse(content={"bookings": bookings, "next_cursor": next_cursor})
+
+@app.get("/admin/export/{table}")
+def export(request: Request, table: str, format: str = "ndjson", after: int = 0, gzip: bool = False):
+    """
+    Download a table as NDJSON or CSV.
+
+    Args:
+        request (Request): The HTTP request object.
+        table (str): "bookings", "rides" or "feedback".
+        format (str): "ndjson" or "csv".
+        after (int): Only rows with a greater ID, for incremental exports.
+        gzip (bool): Whether to gzip the download.
+
+    Returns:
+        StreamingResponse: The export as a file download, or an error message.
+    """
+    session = get_session(request)
+    if not session or not session.get("is_admin"):
+        return JSONResponse(content={"error": "Admin access required"}, status_code=403)
+    if table not in EXPORTS:
+        return JSONResponse(content={"error": f"table must be one of {', '.join(EXPORTS)}"}, status_code=404)
+    if format not in FORMATS:
+        return JSONResponse(content={"error": f"format must be one of {', '.join(FORMATS)}"}, status_code=400)
+
+    filename = f"{table}.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        export_table(table, format, after, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/admin/scooter-ratings")
+def scooter_rating(request: Request, id: int):
+    """
+    Retrieve a scooter's rating aggregates.
+
+    Args:
+        request (Request): The HTTP request object.
+        id (int): The ID of the scooter.
+
+    Returns:
+        JSONResponse: The rating count, average, histogram and recent average, or an error message.
+    """
+    session = get_session(request)
+    if not session or not session.get("is_admin"):
+        return JSONResponse(content={"error": "Admin access required"}, status_code=403)
+
+    with read_connection() as conn:
+        rating = scooter_ratings(conn, [id]).get(id)
+    if rating is None:
+        return JSONResponse(content={"error": "No feedback for this scooter"}, status_code=404)
+    return JSONResponse(content={"id": id, "recent_days": ROLLING_DAYS, **rating})
+
+@app.get("/admin/loop-lag")
+def loop_lag(request: Request):
+    """
+    Report recent event loop lag.
+
+    Args:
+        request (Request): The HTTP request object.
+
+    Returns:
+        JSONResponse: Lag statistics or an error message.
+    """
+    session = get_session(request)
+    if not session or not session.get("is_admin"):
+        return JSONResponse(content={"error": "Admin access required"}, status_code=403)
+    return JSONResponse(content=loop_lag_monitor.stats())
+
+@app.get("/admin/mqtt-bus")
+def mqtt_bus(request: Request):
+    """
+    Report the state of the queue between the MQTT client and the app.
+
+    Args:
+        request (Request): The HTTP request object.
+
+    Returns:
+        JSONResponse: Queue depth, drops and processing lag, or an error message.
+    """
+    session = get_session(request)
+    if not session or not session.get("is_admin"):
+        return JSONResponse(content={"error": "Admin access required"}, status_code=403)
+    return JSONResponse(content=mqtt_event_bus.stats())
+
+@app.get("/admin/scooter-history")
+def scooter_history(request: Request, id: int, start: float = None, end: float = None, resolution: str = None):
+    """
+    Retrieve a scooter's battery and position history.
+
+    Args:
+        request (Request): The HTTP request object.
+        id (int): The ID of the scooter.
+        start (float): The start of the window as a Unix timestamp (default: an hour before end).
+        end (float): The end of the window as a Unix timestamp (default: now).
+        resolution (str): "raw", "1m" or "1h" (default: the finest that covers the window).
+
+    Returns:
+        JSONResponse: The samples in the window, or an error message.
+    """
+    session = get_session(request)
+    if not session or not session.get("is_admin"):
+        return JSONResponse(content={"error": "Admin access required"}, status_code=403)
+
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        return JSONResponse(content={"error": "start must be before end"}, status_code=400)
+
+    try:
+        history = telemetry_history.query(id, start, end, resolution)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    if history is None:
+        return JSONResponse(content={"error": "No history for this scooter"}, status_code=404)
+
+    resolution, samples = history
+    return JSONResponse(content={"id": id, "resolution": resolution, "samples": samples})
+
 def main():
     """
     Main entry point for the backend application.
@@ -749,6 +1134,7 @@ def main():
     Initializes the database and starts the FastAPI server.
     """
     initialize_database()
+    recover_bookings()
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
 
 if __name__ == "__main__":
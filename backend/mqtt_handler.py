@@ -1,18 +1,186 @@
 import asyncio
-import sqlite3
+import json
+import os
+import time
+import uuid
 
 from paho.mqtt.client import Client
 from paho.mqtt.client import MQTTMessage
 
-from db_setup import DATABASE
+from db import run_write
+from event_bus import EventBus
+from fleet_snapshot import fleet_snapshot
+from telemetry import parse_telemetry, telemetry_ingestor
+from timeseries import telemetry_history
 
 # MQTT setup
 mqtt_client = Client()
-mqtt_broker = "mqtt.item.ntnu.no"
-mqtt_port = 1883
+# Broker address (override with MQTT_BROKER and MQTT_PORT, e.g. for load tests)
+mqtt_broker = os.environ.get("MQTT_BROKER", "mqtt.item.ntnu.no")
+mqtt_port = int(os.environ.get("MQTT_PORT", 1883))
 
-# Dictionary to store responses from scooters
-mqtt_responses = {}
+# Identifies this backend process among the workers sharing the broker
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+# Scooters answer commands on a topic only this process subscribes to
+REPLY_TOPIC = f"team20/backend/reply/{WORKER_ID}"
+# Fleet changes made by any process, so every process can keep its snapshot current
+FLEET_TOPIC = "team20/backend/fleet"
+# Shared subscription group: each status and telemetry message goes to one
+# process of the group only. Set MQTT_SHARE_GROUP to "" for brokers without
+# shared subscriptions, when running a single process.
+SHARE_GROUP = os.environ.get("MQTT_SHARE_GROUP", "team20-backend")
+
+# Seconds to wait for a scooter to answer a command (override with MQTT_COMMAND_TIMEOUT)
+COMMAND_TIMEOUT = float(os.environ.get("MQTT_COMMAND_TIMEOUT", 5.0))
+# Statuses sent by scooters in reply to a command
+REPLY_STATUSES = ("activated", "parked", "parked_normal_fare", "parked_increased_fare")
+
+# Commands awaiting a reply, keyed by correlation ID: (scooter_id, future).
+# Only used on the event loop.
+pending_commands = {}
+
+def parse_status(payload: str):
+    """
+    Parse a status message from a scooter.
+
+    Scooters reply to commands with a JSON object carrying the status and the
+    correlation ID of the command. Plain-text statuses are still accepted.
+
+    Args:
+        payload (str): The decoded message payload.
+
+    Returns:
+        tuple: The status and the correlation ID (or None).
+    """
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        return payload, None
+    if not isinstance(message, dict):
+        return payload, None
+    return message.get("status"), message.get("id")
+
+def resolve_command(scooter_id: int, status: str, correlation_id: str = None):
+    """
+    Complete the pending command a reply belongs to.
+
+    Args:
+        scooter_id (int): The ID of the scooter that replied.
+        status (str): The status sent by the scooter.
+        correlation_id (str): The correlation ID echoed by the scooter, if any.
+    """
+    if correlation_id is None:
+        # Replies without an ID go to the oldest command sent to the scooter
+        correlation_id = next((key for key, (sid, _) in pending_commands.items() if sid == scooter_id), None)
+    entry = pending_commands.pop(correlation_id, None)
+    if entry is None:
+        return
+
+    # The command may have timed out in the meantime
+    future = entry[1]
+    if not future.done():
+        future.set_result(status)
+
+def mark_collided(conn, scooter_ids: list):
+    """
+    Take scooters that reported a collision out of service.
+
+    Args:
+        conn (sqlite3.Connection): A connection inside an open write transaction.
+        scooter_ids (list): The IDs of the scooters.
+    """
+    rows = [(scooter_id,) for scooter_id in scooter_ids]
+    # Terminate any ride for the scooters, including one still being started
+    conn.executemany("""
+        DELETE FROM bookings
+        WHERE scooter_id = ? AND status IN ('activating', 'active', 'stopping')
+    """, rows)
+    # Mark the scooters as needing fixing and free them up
+    conn.executemany("UPDATE scooters SET needs_fixing = 1, isBooked = 0 WHERE id = ?", rows)
+
+async def handle_messages(messages: list):
+    """
+    Handle a batch of messages received from the MQTT broker.
+
+    Runs on the event loop. Database writes caused by the batch are made in
+    a single transaction.
+
+    Args:
+        messages (list): (topic, payload, received_at) tuples, oldest first.
+    """
+    collisions = []
+    for topic, payload, received_at in messages:
+        if topic == FLEET_TOPIC:
+            apply_fleet_changes(payload)
+            continue
+
+        try:
+            scooter_id = int(topic.split("/")[-1])
+        except ValueError:
+            continue
+
+        # Telemetry is frequent, so it is only collected here and written in batches
+        if topic.startswith("team20/scooter/telemetry/"):
+            report = parse_telemetry(payload)
+            if report is not None:
+                telemetry_ingestor.submit(scooter_id, report)
+                # The history needs both battery and position
+                if all(key in report for key in ("battery", "lat", "lng")):
+                    telemetry_history.record(scooter_id, received_at, report)
+            continue
+
+        print(f"Received message on topic {topic}: {payload}")
+        status, correlation_id = parse_status(payload)
+
+        if status in REPLY_STATUSES:
+            resolve_command(scooter_id, status, correlation_id)
+
+        # Detect collision and mark scooter as needing fixing
+        if status == "collision" and scooter_id not in collisions:
+            collisions.append(scooter_id)
+
+    if collisions:
+        try:
+            await run_write(mark_collided, collisions)
+        except Exception as e:
+            print(f"Error handling collision: {e}")
+            return
+        fleet_snapshot.update_many([{"id": scooter_id, "needsFixing": 1, "isBooked": 0} for scooter_id in collisions])
+
+def publish_fleet_changes(deltas: list):
+    """
+    Share fleet changes made by this process with the other workers.
+
+    Args:
+        deltas (list): Dicts with the scooter "id" and its changed fields.
+    """
+    mqtt_client.publish(FLEET_TOPIC, json.dumps({"origin": WORKER_ID, "time": time.time(), "deltas": deltas}))
+
+def apply_fleet_changes(payload: str):
+    """
+    Apply fleet changes published by another worker to this process's snapshot.
+
+    Telemetry is only received by one worker, so the positions and battery
+    levels it wrote are also added to this process's telemetry history.
+
+    Args:
+        payload (str): The decoded message payload.
+    """
+    try:
+        message = json.loads(payload)
+        origin, timestamp, deltas = message["origin"], float(message["time"]), list(message["deltas"])
+    except (ValueError, TypeError, KeyError):
+        return
+    if origin == WORKER_ID:
+        return
+
+    fleet_snapshot.update_many(deltas, replicate=False)
+    for delta in deltas:
+        if all(key in delta for key in ("battery", "lat", "lng")):
+            telemetry_history.record(delta["id"], timestamp, delta)
+
+# Messages handed from the MQTT network thread to the event loop
+mqtt_event_bus = EventBus(handle_messages)
 
 def on_connect(client: Client, userdata, flags, rc):
     """
@@ -24,78 +192,82 @@ def on_connect(client: Client, userdata, flags, rc):
         flags: Response flags sent by the broker.
         rc: Connection result.
     """
-    print("Connected to MQTT broker")
-    # Subscribe to the status topic
-    client.subscribe("team20/scooter/status/#")
+    print(f"Connected to MQTT broker as worker {WORKER_ID}")
+    # Status and telemetry are fleet-wide events, handled by one worker each
+    share = f"$share/{SHARE_GROUP}/" if SHARE_GROUP else ""
+    # Scooters publish statuses and replies at QoS 1; telemetry is resent every few seconds anyway
+    client.subscribe(f"{share}team20/scooter/status/#", qos=1)
+    client.subscribe(f"{share}team20/scooter/telemetry/#")
+    # Replies to this worker's commands, and fleet changes made by every worker
+    client.subscribe(f"{REPLY_TOPIC}/#", qos=1)
+    client.subscribe(FLEET_TOPIC)
 
 def on_message(client, userdata, msg: MQTTMessage):
     """
     Callback for when a message is received from the MQTT broker.
 
+    Runs on the MQTT network thread, so the message is only queued for
+    handle_messages() and intake is never held up by the app.
+
     Args:
         client (Client): The MQTT client instance.
         userdata: User-defined data.
         msg (MQTTMessage): The received message.
     """
     topic = msg.topic
-    payload = msg.payload.decode()
-    print(f"Received message on topic {topic}: {payload}")
+    if not topic.startswith(("team20/scooter/status/", "team20/scooter/telemetry/", REPLY_TOPIC, FLEET_TOPIC)):
+        return
+    mqtt_event_bus.put((topic, msg.payload.decode(), time.time()))
 
-    # Extract scooter ID from the topic
-    if topic.startswith("team20/scooter/status/"):
-        scooter_id = int(topic.split("/")[-1])
-        mqtt_responses[scooter_id] = payload
+def start_mqtt():
+    """
+    Connect to the MQTT broker and start the network thread.
 
-        # Detect collision and mark scooter as needing fixing
-        if payload == "collision":
-            conn = sqlite3.connect(DATABASE)
-            cursor = conn.cursor()
-            try:
-                cursor.execute("BEGIN TRANSACTION")
-                # Mark the scooter as needing fixing
-                cursor.execute("UPDATE scooters SET needs_fixing = 1 WHERE id = ?", (scooter_id,))
-                # Terminate any active booking for the scooter
-                cursor.execute("""
-                    DELETE FROM bookings
-                    WHERE scooter_id = ? AND status = 'active'
-                """, (scooter_id,))
-                # Free up the scooter
-                cursor.execute("UPDATE scooters SET isBooked = 0 WHERE id = ?", (scooter_id,))
-                conn.commit()
-            except Exception as e:
-                conn.rollback()
-                print(f"Error handling collision: {e}")
-            finally:
-                conn.close()
-
-# Initialize MQTT client
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
-mqtt_client.connect(mqtt_broker, mqtt_port)
-mqtt_client.loop_start()
-
-async def send_command(scooter_id, command):
+    Called on startup by each worker process, after mqtt_event_bus has been started.
+    """
+    mqtt_client.on_connect = on_connect
+    mqtt_client.on_message = on_message
+    mqtt_client.connect(mqtt_broker, mqtt_port)
+    mqtt_client.loop_start()
+    fleet_snapshot.replicate = publish_fleet_changes
+
+def stop_mqtt():
+    """
+    Disconnect from the MQTT broker and stop the network thread.
+    """
+    fleet_snapshot.replicate = None
+    mqtt_client.disconnect()
+    mqtt_client.loop_stop()
+
+async def send_command(scooter_id, command, timeout=COMMAND_TIMEOUT):
     """
     Send a command to a scooter and wait for a response.
 
     Args:
         scooter_id (int): The ID of the scooter.
         command (str): The command to send.
+        timeout (float): Seconds to wait for the response.
 
     Returns:
         str or None: The response from the scooter, or None if no response is received.
     """
+    correlation_id = uuid.uuid4().hex
+    future = asyncio.get_running_loop().create_future()
+    pending_commands[correlation_id] = (scooter_id, future)
+
     topic = f"team20/scooter/command/{scooter_id}"
-    mqtt_client.publish(topic, command)
+    message = {"command": command, "id": correlation_id, "reply_to": f"{REPLY_TOPIC}/{scooter_id}"}
+    # The scooter drops the command if the broker delivers it twice
+    mqtt_client.publish(topic, json.dumps(message), qos=1)
     print(f"Sent '{command}' command to {topic}")
 
-    # Wait for a response
-    for _ in range(25):  # Wait up to 5 seconds
-        if mqtt_responses.get(scooter_id) in ("activated", "parked", "parked_normal_fare", "parked_increased_fare"):
-            response = mqtt_responses.pop(scooter_id)
-            print(f"Received response: {response}")
-            return response
-        await asyncio.sleep(0.2)
-
-    print("No response received within timeout.")
-    return None
\ No newline at end of file
+    # Wait for the reply carrying our correlation ID
+    try:
+        response = await asyncio.wait_for(future, timeout)
+        print(f"Received response: {response}")
+        return response
+    except asyncio.TimeoutError:
+        print("No response received within timeout.")
+        return None
+    finally:
+        pending_commands.pop(correlation_id, None)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytz
+
+TIMEZONE = pytz.timezone("Europe/Oslo")
+
+# Days covered by the rolling average, today included
+ROLLING_DAYS = 7
+STARS = range(1, 6)
+
+# Keeps the aggregates up to date as feedback is inserted, in the same transaction
+RATINGS_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS feedback_ratings_insert AFTER INSERT ON feedback
+WHEN new.scooter_id IS NOT NULL
+BEGIN
+    INSERT INTO scooter_ratings (scooter_id, count, total, {', '.join(f'stars_{star}' for star in STARS)})
+    VALUES (new.scooter_id, 1, new.rating, {', '.join(f'new.rating = {star}' for star in STARS)})
+    ON CONFLICT (scooter_id) DO UPDATE SET
+        count = count + 1,
+        total = total + excluded.total,
+        {', '.join(f'stars_{star} = stars_{star} + excluded.stars_{star}' for star in STARS)};
+
+    INSERT INTO scooter_rating_days (scooter_id, day, count, total)
+    SELECT new.scooter_id, date(new.created_at), 1, new.rating WHERE new.created_at IS NOT NULL
+    ON CONFLICT (scooter_id, day) DO UPDATE SET count = count + 1, total = total + excluded.total;
+
+    -- Only the days of the rolling average are kept
+    DELETE FROM scooter_rating_days
+    WHERE scooter_id = new.scooter_id AND day < date(new.created_at, '-{ROLLING_DAYS - 1} days');
+END
+"""
+
+def today() -> str:
+    """
+    Get today's date in the app's time zone.
+
+    Returns:
+        str: The date as "%Y-%m-%d".
+    """
+    return datetime.now(TIMEZONE).strftime("%Y-%m-%d")
+
+def rolling_start(day: str) -> str:
+    """
+    Get the first day of the rolling average that ends on a day.
+
+    Args:
+        day (str): The last day, as "%Y-%m-%d".
+
+    Returns:
+        str: The first day, as "%Y-%m-%d".
+    """
+    return (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=ROLLING_DAYS - 1)).strftime("%Y-%m-%d")
+
+def rebuild_ratings(conn: sqlite3.Connection, day: str = None):
+    """
+    Recompute the rating aggregates from the feedback table.
+
+    Needed after feedback is changed or deleted, or inserted with the
+    trigger dropped (as the seeder does).
+
+    Args:
+        conn (sqlite3.Connection): A connection inside an open write transaction.
+        day (str): The day the rolling average ends on (default: today).
+    """
+    conn.execute("DELETE FROM scooter_ratings")
+    conn.execute(f"""
+        INSERT INTO scooter_ratings (scooter_id, count, total, {', '.join(f'stars_{star}' for star in STARS)})
+        SELECT scooter_id, COUNT(*), SUM(rating), {', '.join(f'SUM(rating = {star})' for star in STARS)}
+        FROM feedback
+        WHERE scooter_id IS NOT NULL
+        GROUP BY scooter_id
+    """)
+    conn.execute("DELETE FROM scooter_rating_days")
+    conn.execute("""
+        INSERT INTO scooter_rating_days (scooter_id, day, count, total)
+        SELECT scooter_id, date(created_at), COUNT(*), SUM(rating)
+        FROM feedback
+        WHERE scooter_id IS NOT NULL AND created_at >= ?
+        GROUP BY scooter_id, date(created_at)
+    """, (rolling_start(day or today()),))
+
+def scooter_ratings(conn: sqlite3.Connection, scooter_ids: list, day: str = None) -> dict:
+    """
+    Get the rating aggregates of some scooters.
+
+    Reads one row per scooter and at most ROLLING_DAYS day buckets, however
+    much feedback the scooters have.
+
+    Args:
+        conn (sqlite3.Connection): A database connection.
+        scooter_ids (list): The IDs of the scooters.
+        day (str): The day the rolling average ends on (default: today).
+
+    Returns:
+        dict: Scooter ID -> count, average, histogram (stars -> count) and
+        the count and average over the last ROLLING_DAYS days (recent_count,
+        recent_average). Scooters without feedback are left out.
+    """
+    if not scooter_ids:
+        return {}
+    placeholders = ", ".join("?" * len(scooter_ids))
+    rows = conn.execute(f"""
+        SELECT scooter_id, count, total, {', '.join(f'stars_{star}' for star in STARS)}
+        FROM scooter_ratings WHERE scooter_id IN ({placeholders})
+    """, scooter_ids).fetchall()
+    recent = {
+        row[0]: (row[1], row[2])
+        for row in conn.execute(f"""
+            SELECT scooter_id, SUM(count), SUM(total) FROM scooter_rating_days
+            WHERE scooter_id IN ({placeholders}) AND day >= ?
+            GROUP BY scooter_id
+        """, (*scooter_ids, rolling_start(day or today()))).fetchall()
+    }
+
+    ratings = {}
+    for scooter_id, count, total, *stars in rows:
+        recent_count, recent_total = recent.get(scooter_id, (0, 0))
+        ratings[scooter_id] = {
+            "count": count,
+            "average": round(total / count, 2),
+            "histogram": dict(zip(STARS, stars)),
+            "recent_count": recent_count,
+            "recent_average": round(recent_total / recent_count, 2) if recent_count else None
+        }
+    return ratings
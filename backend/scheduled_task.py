@@ -1,68 +1,191 @@
 import asyncio
+import heapq
+import json
+import threading
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime
 
 import pytz
-import sqlite3
 from fastapi import FastAPI
 
-from db_setup import DATABASE
+from db import close_pools, read_connection, run_write
+from fleet_snapshot import fleet_snapshot
+from fleet_stream import fleet_broadcaster
+from loop_lag import loop_lag_monitor
+from mqtt_handler import mqtt_event_bus, start_mqtt, stop_mqtt
+from telemetry import telemetry_ingestor
 
 TIMEZONE = pytz.timezone("Europe/Oslo")
 
-# Lifespan context manager for startup and shutdown tasks
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+def to_timestamp(value: str) -> float:
     """
-    Context manager for managing the application's lifespan.
+    Convert a database timestamp in local time to a Unix timestamp.
 
     Args:
-        app (FastAPI): The FastAPI application instance.
+        value (str): The timestamp as "%Y-%m-%d %H:%M:%S" in Europe/Oslo time.
+
+    Returns:
+        float: Seconds since the epoch.
     """
-    async def cleanup_expired_bookings():
+    return TIMEZONE.localize(datetime.strptime(value, "%Y-%m-%d %H:%M:%S")).timestamp()
+
+class ExpiryScheduler:
+    """
+    Releases pending bookings at their exact expiry time.
+
+    Deadlines are kept in a min-heap, so the scheduler only wakes up when the
+    earliest booking expires or a new booking is scheduled. Bookings that were
+    activated or deleted in the meantime are skipped by the release query.
+    """
+
+    def __init__(self):
+        self._heap = []  # (deadline, booking_id)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop = None
+        self._wakeup: asyncio.Event = None
+
+    def schedule(self, booking_id: int, expires_at: str):
+        """
+        Schedule a pending booking for release. Safe to call from any thread.
+
+        Args:
+            booking_id (int): The ID of the booking.
+            expires_at (str): The expiry time as stored in the database.
+        """
+        with self._lock:
+            heapq.heappush(self._heap, (to_timestamp(expires_at), booking_id))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def seed(self):
+        """
+        Schedule every pending booking currently in the database.
+        """
+        with read_connection() as conn:
+            rows = conn.execute("SELECT id, expires_at FROM bookings WHERE status = 'pending'").fetchall()
+        for booking_id, expires_at in rows:
+            self.schedule(booking_id, expires_at)
+
+    def _pop_due(self, now: float):
+        """
+        Remove and return the bookings whose deadline has passed.
+
+        Args:
+            now (float): The current Unix time.
+
+        Returns:
+            list: The IDs of the due bookings.
         """
-        Periodically clean up expired bookings and free up scooters.
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def _next_deadline(self):
+        """
+        Get the earliest scheduled deadline.
+
+        Returns:
+            float or None: The earliest scheduled deadline, if any.
+        """
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    async def run(self):
+        """
+        Release expired bookings as their deadlines pass, until cancelled.
         """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
         while True:
-            conn = sqlite3.connect(DATABASE)
-            cursor = conn.cursor()
+            due = self._pop_due(time.time())
+            if due:
+                try:
+                    for scooter_id in await run_write(release_expired_bookings, due):
+                        fleet_snapshot.update(scooter_id, isBooked=0)
+                except Exception as e:
+                    print(f"Error releasing expired bookings: {e}")
 
-            # Find and delete expired bookings
-            cursor.execute("""
-                SELECT id, scooter_id, expires_at FROM bookings
-                WHERE status = 'pending'
-            """)
-            expired_bookings = cursor.fetchall()
+            # Sleep until the next deadline or until a new booking is scheduled
+            deadline = self._next_deadline()
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
 
-            for booking in expired_bookings:
-                booking_id, scooter_id, expires_at = booking
+def release_expired_bookings(conn, booking_ids: list):
+    """
+    Delete expired pending bookings and free up their scooters.
 
-                # Convert expires_at to timezone-aware datetime
-                expires_at_dt = TIMEZONE.localize(datetime.strptime(expires_at, "%Y-%m-%d %H:%M:%S"))
-                time_now = TIMEZONE.localize(datetime.strptime(datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S"))
+    Args:
+        conn (sqlite3.Connection): A connection inside an open write transaction.
+        booking_ids (list): The IDs of the bookings to release.
+
+    Returns:
+        list: The IDs of the scooters that were freed up.
+    """
+    now = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    ids = json.dumps(booking_ids)
+    scooter_ids = [row[0] for row in conn.execute("""
+        UPDATE scooters SET isBooked = 0
+        WHERE id IN (
+            SELECT scooter_id FROM bookings
+            WHERE id IN (SELECT value FROM json_each(?))
+              AND status = 'pending' AND expires_at <= ?
+        )
+        RETURNING id
+    """, (ids, now))]
+    conn.execute("""
+        DELETE FROM bookings
+        WHERE id IN (SELECT value FROM json_each(?))
+          AND status = 'pending' AND expires_at <= ?
+    """, (ids, now))
+    return scooter_ids
 
-                if expires_at_dt < time_now:
-                    try:
-                        cursor.execute("BEGIN TRANSACTION")
-                        cursor.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-                        cursor.execute("UPDATE scooters SET isBooked = 0 WHERE id = ?", (scooter_id,))
-                        conn.commit()
-                    except Exception as e:
-                        conn.rollback()
+# Shared scheduler, fed by book_scooter
+expiry_scheduler = ExpiryScheduler()
 
-            conn.close()
+# Lifespan context manager for startup and shutdown tasks
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Context manager for managing the application's lifespan.
 
-            # Wait for 30 seconds before the next cleanup
-            await asyncio.sleep(30)
+    Args:
+        app (FastAPI): The FastAPI application instance.
+    """
+    fleet_broadcaster.start()
+    mqtt_event_bus.start()
+    start_mqtt()
 
-    # Start the periodic task
-    task = asyncio.create_task(cleanup_expired_bookings())
+    # Start the expiry scheduler with the bookings already in the database
+    expiry_scheduler.seed()
+    task = asyncio.create_task(expiry_scheduler.run())
+    lag_probe = asyncio.create_task(loop_lag_monitor.run())
+    telemetry_task = asyncio.create_task(telemetry_ingestor.run())
+    mqtt_task = asyncio.create_task(mqtt_event_bus.run())
 
     yield  # Yield control to the application
 
-    # Cancel the periodic task on shutdown
+    # Stop taking MQTT messages, so the event bus can be drained below
+    stop_mqtt()
+
+    # Cancel the background tasks on shutdown and wait for them to finish
+    lag_probe.cancel()
+    mqtt_task.cancel()
+    telemetry_task.cancel()
     task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        print("Periodic cleanup task cancelled.")
\ No newline at end of file
+    await asyncio.gather(lag_probe, mqtt_task, telemetry_task, task, return_exceptions=True)
+    print("Background tasks cancelled.")
+
+    # Handle the messages still queued, then write the telemetry they and
+    # earlier messages reported since the last flush
+    await mqtt_event_bus.drain()
+    await telemetry_ingestor.flush()
+
+    close_pools()
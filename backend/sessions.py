@@ -0,0 +1,133 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+# Signing keys, comma separated and newest first (override the key file, e.g. when rotating)
+SECRET_KEYS_ENV = "SESSION_SECRET_KEYS"
+# File with one key per line, newest first, created on first start if missing
+KEY_FILE = os.environ.get("SESSION_KEY_FILE", "session_keys")
+# Seconds a session stays valid after login
+SESSION_MAX_AGE = int(os.environ.get("SESSION_MAX_AGE", 7 * 24 * 3600))
+# Recently verified tokens kept per process
+CACHE_SIZE = 10000
+
+def load_secret_keys(path: str = KEY_FILE) -> list:
+    """
+    Load the session signing keys shared by every worker process.
+
+    The keys come from SESSION_SECRET_KEYS if it is set, otherwise from the
+    key file. If the file does not exist yet, a random key is written to it;
+    the file is linked into place atomically, so workers starting at the same
+    time all end up with the key of whichever one got there first.
+
+    Args:
+        path (str): The path of the key file.
+
+    Returns:
+        list: The keys, newest first. The first one signs new sessions.
+    """
+    if os.environ.get(SECRET_KEYS_ENV):
+        keys = [key.strip() for key in os.environ[SECRET_KEYS_ENV].split(",") if key.strip()]
+        if keys:
+            return keys
+
+    if not os.path.exists(path):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            file.write(secrets.token_urlsafe(32) + "\n")
+        try:
+            os.link(temporary, path)
+            print(f"Created a new session key in {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+
+    with open(path) as file:
+        keys = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+    if not keys:
+        raise RuntimeError(f"No session keys in {path}")
+    return keys
+
+class SessionManager:
+    """
+    Signs and verifies session cookies.
+
+    Sessions are signed with the first key and accepted if signed with any of
+    the keys, so a new key can be put in front of the old one and the old one
+    removed once its sessions have expired. Tokens carry their signing time
+    and are rejected after max_age seconds.
+
+    Verified tokens are kept in an LRU cache until they expire, so pages that
+    are loaded over and over do not verify the same signature every time.
+    """
+
+    def __init__(self, secret_keys: list, max_age: int = SESSION_MAX_AGE, cache_size: int = CACHE_SIZE):
+        # itsdangerous signs with the last key in the list
+        self.serializer = URLSafeTimedSerializer(list(reversed(secret_keys)), salt="session")
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # Token -> (session, expiry time)
+        self._lock = threading.Lock()
+
+    def dumps(self, session: dict) -> str:
+        """
+        Create a signed session token.
+
+        Args:
+            session (dict): The session data.
+
+        Returns:
+            str: The token to store in the session cookie.
+        """
+        return self.serializer.dumps(session)
+
+    def loads(self, token: str) -> dict:
+        """
+        Verify a session token.
+
+        Args:
+            token (str): The token from the session cookie.
+
+        Returns:
+            dict: The session data, or an empty dict if the token is invalid or expired.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(token)
+            if cached is not None:
+                session, expires = cached
+                if now < expires:
+                    self._cache.move_to_end(token)
+                    return dict(session)
+                del self._cache[token]
+
+        try:
+            session, signed = self.serializer.loads(token, max_age=self.max_age, return_timestamp=True)
+        except (BadSignature, SignatureExpired):
+            return {}
+        if not isinstance(session, dict):
+            return {}
+
+        with self._lock:
+            self._cache[token] = (session, signed.timestamp() + self.max_age)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(session)
+
+    def forget(self, token: str):
+        """
+        Drop a token from the cache, e.g. on logout.
+
+        Args:
+            token (str): The token from the session cookie.
+        """
+        with self._lock:
+            self._cache.pop(token, None)
+
+session_manager = SessionManager(load_secret_keys())
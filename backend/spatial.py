@@ -0,0 +1,128 @@
+import math
+import sqlite3
+
+# Zoom level from which individual scooters are shown instead of clusters
+CLUSTER_MAX_ZOOM = 14
+# Number of grid cells per 256px map tile when clustering
+CELLS_PER_TILE = 4
+
+def parse_bbox(bbox: str):
+    """
+    Parse a bounding box in Leaflet's toBBoxString() format.
+
+    Args:
+        bbox (str): The bounding box as "west,south,east,north".
+
+    Returns:
+        tuple: The (west, south, east, north) coordinates.
+
+    Raises:
+        ValueError: If the bounding box is malformed.
+    """
+    parts = bbox.split(",")
+    if len(parts) != 4:
+        raise ValueError("bbox must be 'west,south,east,north'")
+    west, south, east, north = (float(part) for part in parts)
+    if south > north or west > east:
+        raise ValueError("bbox corners are in the wrong order")
+    return west, south, east, north
+
+def scooters_in_bbox(conn: sqlite3.Connection, bbox: tuple):
+    """
+    Find all scooters inside a bounding box using the R*Tree index.
+
+    Args:
+        conn (sqlite3.Connection): A database connection.
+        bbox (tuple): The (west, south, east, north) coordinates.
+
+    Returns:
+        list: Rows of (id, lat, lng, isBooked, needs_fixing).
+    """
+    west, south, east, north = bbox
+    return conn.execute("""
+        SELECT s.id, s.lat, s.lng, s.isBooked, s.needs_fixing
+        FROM scooters_rtree r
+        JOIN scooters s ON s.id = r.id
+        WHERE r.min_lat <= ? AND r.max_lat >= ?
+          AND r.min_lng <= ? AND r.max_lng >= ?
+    """, (north, south, east, west)).fetchall()
+
+def clusters_in_bbox(conn: sqlite3.Connection, bbox: tuple, zoom: int):
+    """
+    Group the scooters inside a bounding box into grid cells sized for a zoom level.
+
+    Scooters needing fixing are left out, as they are not shown on the map.
+
+    Args:
+        conn (sqlite3.Connection): A database connection.
+        bbox (tuple): The (west, south, east, north) coordinates.
+        zoom (int): The map zoom level.
+
+    Returns:
+        list: Rows of (count, lat, lng, id, isBooked). The id and isBooked
+        columns are only meaningful for cells holding a single scooter.
+    """
+    west, south, east, north = bbox
+    cell = 360 / (2 ** zoom) / CELLS_PER_TILE
+    return conn.execute("""
+        SELECT COUNT(*), AVG(s.lat), AVG(s.lng), MIN(s.id), MIN(s.isBooked)
+        FROM scooters_rtree r
+        JOIN scooters s ON s.id = r.id
+        WHERE r.min_lat <= ? AND r.max_lat >= ?
+          AND r.min_lng <= ? AND r.max_lng >= ?
+          AND s.needs_fixing = 0
+        GROUP BY CAST((s.lat + 90) / ? AS INTEGER), CAST((s.lng + 180) / ? AS INTEGER)
+    """, (north, south, east, west, cell, cell)).fetchall()
+
+# Search radii for nearest-neighbour queries, in metres
+KNN_START_RADIUS = 250
+KNN_MAX_RADIUS = 50000
+METRES_PER_DEGREE = 111320
+
+def nearest_available(conn: sqlite3.Connection, lat: float, lng: float, k: int, min_battery: int):
+    """
+    Find the k nearest scooters that can be booked.
+
+    The search box around the point is grown until it holds k available
+    scooters within the search radius, so only the R*Tree entries near the
+    point are ever read. Distances are ordered in SQL using an
+    equirectangular approximation, which is accurate at city scale.
+
+    Args:
+        conn (sqlite3.Connection): A database connection.
+        lat (float): Latitude of the search point.
+        lng (float): Longitude of the search point.
+        k (int): The number of scooters to return.
+        min_battery (int): The minimum battery level in percent.
+
+    Returns:
+        list: Rows of (id, lat, lng, battery, distance in metres), nearest first.
+    """
+    lng_scale = math.cos(math.radians(lat))
+    radius = KNN_START_RADIUS
+    while True:
+        dlat = radius / METRES_PER_DEGREE
+        dlng = radius / (METRES_PER_DEGREE * max(lng_scale, 0.01))
+        rows = conn.execute("""
+            SELECT id, lat, lng, battery, dist2 FROM (
+                SELECT s.id, s.lat, s.lng, s.battery,
+                       (s.lat - :lat) * (s.lat - :lat)
+                       + ((s.lng - :lng) * :scale) * ((s.lng - :lng) * :scale) AS dist2
+                FROM scooters_rtree r
+                JOIN scooters s ON s.id = r.id
+                WHERE r.min_lat <= :lat + :dlat AND r.max_lat >= :lat - :dlat
+                  AND r.min_lng <= :lng + :dlng AND r.max_lng >= :lng - :dlng
+                  AND s.isBooked = 0 AND s.needs_fixing = 0 AND s.battery >= :min_battery
+            )
+            WHERE dist2 <= :radius2
+            ORDER BY dist2
+            LIMIT :k
+        """, {
+            "lat": lat, "lng": lng, "scale": lng_scale, "dlat": dlat, "dlng": dlng,
+            "min_battery": min_battery, "radius2": dlat * dlat, "k": k
+        }).fetchall()
+
+        # Anything closer than the radius lies inside the box, so k hits are final
+        if len(rows) >= k or radius >= KNN_MAX_RADIUS:
+            return [row[:4] + (math.sqrt(row[4]) * METRES_PER_DEGREE,) for row in rows]
+        radius *= 4
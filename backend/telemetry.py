@@ -0,0 +1,117 @@
+import asyncio
+import json
+import threading
+
+from db import run_write
+from fleet_snapshot import fleet_snapshot
+
+# Seconds between batched writes of the latest telemetry
+FLUSH_INTERVAL = 2.0
+# Columns of the scooters table a telemetry report can update
+COLUMNS = ("battery", "lat", "lng")
+
+def parse_telemetry(payload: str):
+    """
+    Parse and validate a telemetry report from a scooter.
+
+    Args:
+        payload (str): The decoded message payload, a JSON object with the
+            state and, if the scooter knows them, battery (percent) and lat
+            and lng (always together).
+
+    Returns:
+        dict or None: The report with only the fields it carried, or None
+        if it is malformed.
+    """
+    try:
+        message = json.loads(payload)
+        report = {"state": message.get("state")}
+        if "battery" in message:
+            report["battery"] = int(message["battery"])
+        if "lat" in message or "lng" in message:
+            report["lat"] = float(message["lat"])
+            report["lng"] = float(message["lng"])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    if not 0 <= report.get("battery", 0) <= 100:
+        return None
+    if not (-90 <= report.get("lat", 0) <= 90 and -180 <= report.get("lng", 0) <= 180):
+        return None
+    return report
+
+class TelemetryIngestor:
+    """
+    Coalesces scooter telemetry and writes it to the database in batches.
+
+    Reports are collected on the event loop as the MQTT event bus hands them
+    over, keeping only the latest value of each field per scooter. Every
+    FLUSH_INTERVAL seconds the collected reports are written in one
+    transaction, with one executemany per set of reported columns, however
+    many arrived. Columns a report does not carry are left as they are.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def submit(self, scooter_id: int, report: dict):
+        """
+        Record a scooter's latest report, on top of the fields of earlier
+        unflushed reports. Safe to call from any thread.
+
+        Args:
+            scooter_id (int): The ID of the scooter.
+            report (dict): The report returned by parse_telemetry().
+        """
+        with self._lock:
+            self._latest.setdefault(scooter_id, {}).update(report)
+
+    async def flush(self):
+        """
+        Write the reports collected since the last flush.
+        """
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        if not latest:
+            return
+
+        # Reports grouped by the columns they update
+        groups = {}
+        for scooter_id, report in latest.items():
+            columns = tuple(column for column in COLUMNS if column in report)
+            if columns:
+                groups.setdefault(columns, []).append((*(report[column] for column in columns), scooter_id))
+        if not groups:
+            return
+
+        def write(conn):
+            for columns, rows in groups.items():
+                # Skip rows that would not change, to spare the spatial index triggers
+                conn.executemany(f"""
+                    UPDATE scooters SET {', '.join(f'{column} = ?{index}' for index, column in enumerate(columns, 1))}
+                    WHERE id = ?{len(columns) + 1}
+                      AND ({' OR '.join(f'{column} != ?{index}' for index, column in enumerate(columns, 1))})
+                """, rows)
+
+        await run_write(write)
+
+        fleet_snapshot.update_many([
+            {"id": scooter_id, **{column: report[column] for column in COLUMNS if column in report}}
+            for scooter_id, report in latest.items()
+            if any(column in report for column in COLUMNS)
+        ])
+
+    async def run(self):
+        """
+        Flush telemetry on a fixed cadence until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error writing telemetry: {e}")
+
+# Shared ingestor, fed by the MQTT handler
+telemetry_ingestor = TelemetryIngestor()
@@ -0,0 +1,341 @@
+import os
+import threading
+from array import array
+
+# Samples kept per scooter at each resolution:
+# raw reports, 15 minutes at the scooters' 5 second interval (override with HISTORY_RAW_RETENTION)
+RAW_RETENTION = int(os.environ.get("HISTORY_RAW_RETENTION", 180))
+# 1-minute buckets, 6 hours (override with HISTORY_MINUTE_RETENTION)
+MINUTE_RETENTION = int(os.environ.get("HISTORY_MINUTE_RETENTION", 360))
+# 1-hour buckets, 7 days (override with HISTORY_HOUR_RETENTION)
+HOUR_RETENTION = int(os.environ.get("HISTORY_HOUR_RETENTION", 168))
+# Rows a ring buffer is first allocated for; it doubles as rows arrive, up to its capacity
+INITIAL_ROWS = 16
+
+# Bucket length in seconds for each resolution
+RESOLUTIONS = {"raw": 0, "1m": 60, "1h": 3600}
+
+# Columns of each ring buffer, as (name, array typecode)
+RAW_COLUMNS = (("time", "d"), ("battery", "f"), ("lat", "d"), ("lng", "d"))
+BUCKET_COLUMNS = (
+    ("time", "d"),  # Start of the bucket
+    ("samples", "I"),
+    ("battery_min", "f"),
+    ("battery_max", "f"),
+    ("battery_mean", "f"),
+    ("lat", "d"),  # Last position in the bucket
+    ("lng", "d"),
+)
+
+class RingBuffer:
+    """
+    A fixed number of rows stored column-wise in arrays.
+
+    The arrays start with room for INITIAL_ROWS rows and double as rows
+    arrive, up to the capacity. Once the buffer is full the oldest row is
+    overwritten, so its memory use never grows past the capacity. Rows must
+    be appended in time order.
+    """
+
+    def __init__(self, capacity: int, columns: tuple):
+        self.capacity = capacity
+        self.columns = {name: array(typecode, [0]) * min(capacity, INITIAL_ROWS) for name, typecode in columns}
+        self._times = self.columns["time"]
+        self._start = 0
+        self.count = 0
+
+    def append(self, values: dict):
+        """
+        Append a row, overwriting the oldest one if the buffer is full.
+
+        Args:
+            values (dict): A value for every column.
+        """
+        if self.count < self.capacity:
+            index = (self._start + self.count) % self.capacity
+            if index == len(self._times):
+                self._grow()
+            self.count += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % self.capacity
+        for name, column in self.columns.items():
+            column[index] = values[name]
+
+    def _grow(self):
+        """
+        Double the room in the arrays, up to the capacity. Only needed before
+        the buffer first fills, while its rows start at index 0.
+        """
+        extra = min(len(self._times), self.capacity - len(self._times))
+        for column in self.columns.values():
+            column.extend(array(column.typecode, [0]) * extra)
+
+    def _time_at(self, position: int) -> float:
+        return self._times[(self._start + position) % self.capacity]
+
+    def _bisect(self, timestamp: float) -> int:
+        """
+        Find the position of the first row at or after a time.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time_at(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def oldest(self):
+        """
+        Get the time of the oldest row.
+
+        Returns:
+            float or None: The time, or None if the buffer is empty.
+        """
+        return self._time_at(0) if self.count else None
+
+    def newest(self):
+        """
+        Get the time of the newest row.
+
+        Returns:
+            float or None: The time, or None if the buffer is empty.
+        """
+        return self._time_at(self.count - 1) if self.count else None
+
+    def range(self, start: float, end: float) -> list:
+        """
+        Get the rows between two times.
+
+        Args:
+            start (float): The earliest time, inclusive.
+            end (float): The latest time, inclusive.
+
+        Returns:
+            list: The rows as dicts, oldest first.
+        """
+        rows = []
+        for position in range(self._bisect(start), self.count):
+            index = (self._start + position) % self.capacity
+            if self._times[index] > end:
+                break
+            rows.append({
+                # Single precision columns are rounded to the precision they can hold
+                name: round(column[index], 2) if column.typecode == "f" else column[index]
+                for name, column in self.columns.items()
+            })
+        return rows
+
+class Rollup:
+    """
+    Downsamples rows into fixed-length buckets kept in a ring buffer.
+
+    The bucket being filled is kept separately until a row for a later bucket
+    arrives, and is included in queries so recent data is never missing.
+    """
+
+    def __init__(self, length: int, capacity: int):
+        self.length = length
+        self.buckets = RingBuffer(capacity, BUCKET_COLUMNS)
+        self._open: dict = None
+
+    def add(self, row: dict):
+        """
+        Add a raw row or a finer bucket to the rollup.
+
+        Args:
+            row (dict): A raw row, or a bucket from a finer rollup.
+
+        Returns:
+            dict or None: The bucket that was closed by this row, if any.
+        """
+        start = row["time"] - row["time"] % self.length
+        closed = None
+        if self._open is not None and self._open["time"] != start:
+            closed = self._open
+            self.buckets.append(closed)
+            self._open = None
+
+        samples = row.get("samples", 1)
+        low = row.get("battery_min", row.get("battery"))
+        high = row.get("battery_max", row.get("battery"))
+        mean = row.get("battery_mean", row.get("battery"))
+        bucket = self._open
+        if bucket is None:
+            self._open = {
+                "time": start,
+                "samples": samples,
+                "battery_min": low,
+                "battery_max": high,
+                "battery_mean": mean,
+                "lat": row["lat"],
+                "lng": row["lng"]
+            }
+        else:
+            total = bucket["samples"] + samples
+            bucket["battery_mean"] = (bucket["battery_mean"] * bucket["samples"] + mean * samples) / total
+            bucket["samples"] = total
+            bucket["battery_min"] = min(bucket["battery_min"], low)
+            bucket["battery_max"] = max(bucket["battery_max"], high)
+            bucket["lat"] = row["lat"]
+            bucket["lng"] = row["lng"]
+        return closed
+
+    def range(self, start: float, end: float) -> list:
+        """
+        Get the buckets that start between two times.
+
+        Args:
+            start (float): The earliest time, inclusive.
+            end (float): The latest time, inclusive.
+
+        Returns:
+            list: The buckets as dicts, oldest first.
+        """
+        rows = self.buckets.range(start - start % self.length, end)
+        if self._open is not None and start - self.length < self._open["time"] <= end:
+            rows.append(dict(self._open))
+        return rows
+
+class ScooterSeries:
+    """
+    The battery and position history of one scooter.
+
+    Raw reports are kept for the most recent period and rolled up into
+    1-minute buckets, which are in turn rolled up into 1-hour buckets.
+    """
+
+    def __init__(self, raw_retention: int, minute_retention: int, hour_retention: int):
+        self.raw = RingBuffer(raw_retention, RAW_COLUMNS)
+        self.minutes = Rollup(RESOLUTIONS["1m"], minute_retention)
+        self.hours = Rollup(RESOLUTIONS["1h"], hour_retention)
+
+    def record(self, row: dict):
+        """
+        Record a raw report.
+
+        Args:
+            row (dict): The report's time, battery, lat and lng.
+        """
+        self.raw.append(row)
+        closed = self.minutes.add(row)
+        if closed is not None:
+            self.hours.add(closed)
+
+    def range(self, start: float, end: float, resolution: str) -> list:
+        """
+        Get the history between two times.
+
+        Args:
+            start (float): The earliest time, inclusive.
+            end (float): The latest time, inclusive.
+            resolution (str): "raw", "1m" or "1h".
+
+        Returns:
+            list: The samples or buckets, oldest first.
+        """
+        if resolution == "raw":
+            return self.raw.range(start, end)
+        if resolution == "1m":
+            return self.minutes.range(start, end)
+        return self.hours.range(start, end)
+
+    def finest_resolution(self, start: float) -> str:
+        """
+        Pick the finest resolution that still holds data from a given time.
+
+        Args:
+            start (float): The earliest time of interest.
+
+        Returns:
+            str: "raw", "1m" or "1h".
+        """
+        for resolution, buffer in (("raw", self.raw), ("1m", self.minutes.buckets)):
+            oldest = buffer.oldest()
+            if buffer.count < buffer.capacity or (oldest is not None and oldest <= start):
+                return resolution
+        return "1h"
+
+class TimeSeriesStore:
+    """
+    In-memory battery and position history for every scooter.
+
+    A scooter's ring buffers are created with its first report and grow with
+    the reports that follow, up to bytes_per_scooter, so memory is bounded by
+    the number of scooters reporting and never grows with the age of the
+    data. Every worker keeps the history of the whole fleet, as history
+    queries can reach any of them.
+    """
+
+    def __init__(self, raw_retention: int = RAW_RETENTION, minute_retention: int = MINUTE_RETENTION,
+                 hour_retention: int = HOUR_RETENTION):
+        self.raw_retention = raw_retention
+        self.minute_retention = minute_retention
+        self.hour_retention = hour_retention
+        self._series = {}
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_per_scooter(self) -> int:
+        """
+        The most memory the ring buffers of one scooter use, in bytes.
+        """
+        columns = sum(array(typecode).itemsize for _, typecode in RAW_COLUMNS)
+        buckets = sum(array(typecode).itemsize for _, typecode in BUCKET_COLUMNS)
+        return columns * self.raw_retention + buckets * (self.minute_retention + self.hour_retention)
+
+    def record(self, scooter_id: int, timestamp: float, report: dict):
+        """
+        Record a telemetry report. Safe to call from any thread.
+
+        Args:
+            scooter_id (int): The ID of the scooter.
+            timestamp (float): When the report was received, as a Unix timestamp.
+            report (dict): The report returned by parse_telemetry().
+        """
+        with self._lock:
+            series = self._series.get(scooter_id)
+            if series is None:
+                series = self._series[scooter_id] = ScooterSeries(
+                    self.raw_retention, self.minute_retention, self.hour_retention
+                )
+            # Keep each series in time order even if the clock steps back
+            last = series.raw.newest()
+            series.record({
+                "time": timestamp if last is None else max(timestamp, last),
+                "battery": report["battery"],
+                "lat": report["lat"],
+                "lng": report["lng"]
+            })
+
+    def query(self, scooter_id: int, start: float, end: float, resolution: str = None):
+        """
+        Get a scooter's history over a time window.
+
+        Args:
+            scooter_id (int): The ID of the scooter.
+            start (float): The start of the window, as a Unix timestamp.
+            end (float): The end of the window, as a Unix timestamp.
+            resolution (str): "raw", "1m" or "1h", or None for the finest
+                resolution that covers the window.
+
+        Returns:
+            tuple or None: The resolution used and the samples, or None if
+            there is no history for the scooter.
+
+        Raises:
+            ValueError: If the resolution is unknown.
+        """
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        with self._lock:
+            series = self._series.get(scooter_id)
+            if series is None:
+                return None
+            resolution = resolution or series.finest_resolution(start)
+            return resolution, series.range(start, end, resolution)
+
+# Shared history of scooter telemetry
+telemetry_history = TimeSeriesStore()
@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from dataset import BACKEND_DIR, CENTER_LAT, CENTER_LNG, get_dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "loadtest"))
+from broker import Broker
+
+# Seconds to wait for the backend to start answering
+STARTUP_TIMEOUT = 120
+# Seconds before a single request is counted as failed
+REQUEST_TIMEOUT = 600
+
+class Benchmark:
+    """
+    One endpoint under test.
+
+    The request factory is called with the request number and returns the
+    arguments for httpx.AsyncClient.request().
+    """
+
+    def __init__(self, name: str, requests: int, make_request, expected_status: int = 200):
+        self.name = name
+        self.requests = requests
+        self.make_request = make_request
+        self.expected_status = expected_status
+
+def free_port() -> int:
+    """
+    Find a free TCP port on localhost.
+
+    Returns:
+        int: The port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit() -> str:
+    """
+    Get the commit being benchmarked.
+
+    Returns:
+        str: The commit hash, or "unknown" outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def start_backend(database: str, port: int, broker_port: int, workers: int) -> subprocess.Popen:
+    """
+    Start the backend on a copy of the dataset.
+
+    Args:
+        database (str): The path of the database file.
+        port (int): The HTTP port.
+        broker_port (int): The port of the local MQTT broker.
+        workers (int): The number of uvicorn worker processes.
+
+    Returns:
+        subprocess.Popen: The backend process.
+    """
+    env = {**os.environ, "SCOOTER_DB": database, "MQTT_BROKER": "127.0.0.1", "MQTT_PORT": str(broker_port)}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The backend did not start")
+
+async def run_benchmark(client: httpx.AsyncClient, benchmark: Benchmark, concurrency: int, warmup: int) -> dict:
+    """
+    Send a benchmark's requests with a fixed number in flight.
+
+    Args:
+        client (httpx.AsyncClient): The client to send the requests with.
+        benchmark (Benchmark): The endpoint under test.
+        concurrency (int): The number of requests in flight at once.
+        warmup (int): Requests sent first and left out of the results.
+
+    Returns:
+        dict: Request and error counts, throughput and latency percentiles.
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(warmup + benchmark.requests))
+
+    async def worker():
+        nonlocal errors
+        for number in counter:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**benchmark.make_request(number))
+                # Form endpoints report failures in an error cookie on the redirect
+                ok = response.status_code == benchmark.expected_status and not any(
+                    cookie.endswith("_error") for cookie in response.cookies
+                )
+            except httpx.HTTPError:
+                ok = False
+            if number < warmup:
+                continue
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        cuts = latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2)
+    }
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    """
+    Log in and return the session cookie.
+    """
+    response = await client.post("/login", data={"username": username, "password": password})
+    return response.cookies["session"]
+
+async def run_suite(base_url: str, args) -> dict:
+    """
+    Run every selected benchmark against a running backend.
+
+    Args:
+        base_url (str): The backend URL.
+        args (argparse.Namespace): The command-line arguments.
+
+    Returns:
+        dict: The results per benchmark.
+    """
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        # Sessions for the user pages, one user per booking made
+        booking_requests = min(args.requests, args.users, args.scooters - args.bookings)
+        # Seeded users are user2, user3, ... (the admin has ID 1)
+        users = rng.sample(range(2, args.users + 2), max(booking_requests, 1))
+        sessions = [await login(client, f"user{user}", "password") for user in users]
+        admin_session = await login(client, "admin", "admin123")
+        # Seeded bookings are on scooters 1..bookings
+        free_scooters = list(range(args.bookings + 1, args.scooters + 1))
+        rng.shuffle(free_scooters)
+        bbox_half = 0.005
+
+        def bbox():
+            lat = CENTER_LAT + (rng.random() - 0.5) * 0.04
+            lng = CENTER_LNG + (rng.random() - 0.5) * 0.12
+            return f"{lng - bbox_half * 2},{lat - bbox_half},{lng + bbox_half * 2},{lat + bbox_half}"
+
+        benchmarks = [
+            Benchmark("scooter-locations", args.requests // 10 or 1, lambda n: {
+                "method": "GET", "url": "/scooter-locations"
+            }),
+            Benchmark("scooter-locations-bbox", args.requests, lambda n: {
+                "method": "GET", "url": "/scooter-locations", "params": {"bbox": bbox(), "zoom": 16}
+            }),
+            Benchmark("scooter-data", args.requests, lambda n: {
+                "method": "GET", "url": "/scooter-data", "params": {"id": rng.randint(1, args.scooters)}
+            }),
+            Benchmark("login", args.requests, lambda n: {
+                "method": "POST", "url": "/login",
+                "data": {"username": f"user{rng.randrange(2, args.users + 2)}", "password": "password"}
+            }, 303),
+            Benchmark("bookings-user", args.requests, lambda n: {
+                "method": "GET", "url": "/bookings", "headers": {"Cookie": f"session={sessions[n % len(sessions)]}"}
+            }),
+            Benchmark("bookings-admin", args.admin_requests, lambda n: {
+                "method": "GET", "url": "/bookings", "headers": {"Cookie": f"session={admin_session}"}
+            }),
+            Benchmark("submit-feedback", args.requests, lambda n: {
+                "method": "POST", "url": "/submit-feedback", "headers": {"Cookie": f"session={sessions[n % len(sessions)]}"},
+                "data": {
+                    "name": "Benchmark", "email": "bench@ntnu.no", "rating": rng.randint(1, 5),
+                    "comments": "Benchmark feedback", "scooter_id": rng.randint(1, args.scooters)
+                }
+            }, 303),
+            # Runs last, as it books scooters for good; every request books a different scooter
+            Benchmark("book-scooter", booking_requests, lambda n: {
+                "method": "POST", "url": "/book-scooter", "headers": {"Cookie": f"session={sessions[n % len(sessions)]}"},
+                "data": {"scooter_id": free_scooters[n % len(free_scooters)]}
+            }, 303),
+        ]
+
+        results = {}
+        for benchmark in benchmarks:
+            if args.only and benchmark.name not in args.only:
+                continue
+            # Booking has no separate warm-up, as each scooter can only be booked once
+            warmup = 0 if benchmark.name == "book-scooter" else min(args.warmup, benchmark.requests)
+            results[benchmark.name] = await run_benchmark(client, benchmark, args.concurrency, warmup)
+            row = results[benchmark.name]
+            print(f"{benchmark.name:<24} {row['rps']:>9} req/s  p50 {row['p50_ms']:>8} ms  "
+                  f"p95 {row['p95_ms']:>8} ms  p99 {row['p99_ms']:>8} ms  errors {row['errors']}")
+        return results
+
+def run(args):
+    """
+    Seed (or reuse) a dataset, start the backend on a copy and run the suite.
+    """
+    dataset = get_dataset(args.scooters, args.users, args.bookings, args.feedback, args.seed)
+    broker = Broker()
+    broker_port = broker.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "bench.db")
+        shutil.copyfile(dataset, database)
+        port = free_port()
+        backend = start_backend(database, port, broker_port, args.workers)
+        try:
+            results = asyncio.run(run_suite(f"http://127.0.0.1:{port}", args))
+        finally:
+            backend.terminate()
+            backend.wait()
+            broker.stop()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": {
+                "scooters": args.scooters,
+                "users": args.users,
+                "bookings": args.bookings,
+                "feedback": args.feedback,
+                "seed": args.seed
+            },
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+def compare(args):
+    """
+    Compare two result files and fail if throughput or latency regressed.
+    """
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    if baseline["meta"]["dataset"] != candidate["meta"]["dataset"]:
+        print("Warning: the runs used different datasets")
+
+    regressions = []
+    print(f"{'benchmark':<24} {'req/s':>19} {'change':>8} {'p95 ms':>21} {'change':>8}")
+    for name, new in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        rps_change = (new["rps"] - old["rps"]) / old["rps"] * 100 if old["rps"] else 0
+        p95_change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+        regressed = rps_change < -args.threshold or p95_change > args.threshold or new["errors"] > old["errors"]
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<24} {old['rps']:>9} -> {new['rps']:>6} {rps_change:>+7.1f}% "
+              f"{old['p95_ms']:>9} -> {new['p95_ms']:>8} {p95_change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        print(f"Regressed beyond {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+def main():
+    """
+    HTTP benchmarks for the backend's hot endpoints over large seeded datasets.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument("--scooters", type=int, default=100000)
+    run_parser.add_argument("--users", type=int, default=100000)
+    run_parser.add_argument("--bookings", type=int, default=50000, help="open bookings, at most one per scooter")
+    run_parser.add_argument("--feedback", type=int, default=1000000)
+    run_parser.add_argument("--seed", type=int, default=20)
+    run_parser.add_argument("--requests", type=int, default=2000, help="requests per benchmark")
+    run_parser.add_argument("--admin-requests", type=int, default=5, help="requests for the admin bookings page")
+    run_parser.add_argument("--warmup", type=int, default=50, help="requests per benchmark left out of the results")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--only", nargs="+", help="only run these benchmarks")
+    run_parser.add_argument("--output", help="result file (default: results/<timestamp>.json)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="allowed change in percent")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+# Seeded databases are kept here and reused by later runs with the same parameters
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+
+# Area the scooters are spread over (around Trondheim)
+CENTER_LAT = 63.422
+CENTER_LNG = 10.395
+SPREAD_LAT = 0.05
+SPREAD_LNG = 0.15
+
+def dataset_path(scooters: int, users: int, bookings: int, feedback: int, seed: int) -> str:
+    """
+    Get the cache path of a seeded database.
+
+    Args:
+        scooters (int): The number of scooters.
+        users (int): The number of users.
+        bookings (int): The number of bookings.
+        feedback (int): The number of feedback rows.
+        seed (int): The random seed.
+
+    Returns:
+        str: The path of the database file.
+    """
+    key = hashlib.sha1(f"{scooters}-{users}-{bookings}-{feedback}-{seed}".encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"bench-{key}.db")
+
+def build_dataset(path: str, scooters: int, users: int, bookings: int, feedback: int, seed: int):
+    """
+    Create a database with the current schema and fill it with generated data.
+
+    Uses the seeding tool in db_setup, so the same parameters always produce
+    the same data: scooters 1..N around Trondheim, with one booking on each
+    of the first ones, and users user2, user3, ... with the password
+    "password" next to the admin (ID 1).
+
+    Args:
+        path (str): The path of the database file to create.
+        scooters (int): The number of scooters.
+        users (int): The number of users.
+        bookings (int): The number of bookings.
+        feedback (int): The number of feedback rows.
+        seed (int): The random seed.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    subprocess.run(
+        [
+            sys.executable, "db_setup.py", "--replace", "--seed", str(seed),
+            "--scooters", str(scooters), "--users", str(users),
+            "--bookings", str(bookings), "--feedback", str(feedback),
+            "--area", f"{CENTER_LAT},{CENTER_LNG},{SPREAD_LAT},{SPREAD_LNG}"
+        ],
+        cwd=BACKEND_DIR, env={**os.environ, "SCOOTER_DB": path}, check=True, stdout=subprocess.DEVNULL
+    )
+
+def get_dataset(scooters: int, users: int, bookings: int, feedback: int, seed: int) -> str:
+    """
+    Get a seeded database, building it if it is not cached yet.
+
+    Returns:
+        str: The path of the cached database file. Copy it before writing to it.
+    """
+    path = dataset_path(scooters, users, bookings, feedback, seed)
+    if not os.path.exists(path):
+        print(f"Building dataset {os.path.basename(path)}...")
+        partial = path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        build_dataset(partial, scooters, users, bookings, feedback, seed)
+        os.replace(partial, path)
+    return path
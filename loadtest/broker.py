@@ -0,0 +1,289 @@
+import asyncio
+import struct
+import threading
+
+# MQTT control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """
+    Check whether a topic matches a subscription filter.
+
+    Args:
+        topic_filter (str): The filter, which may use the + and # wildcards.
+        topic (str): The topic of a published message.
+
+    Returns:
+        bool: True if the topic matches.
+    """
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+def split_shared(topic_filter: str):
+    """
+    Split a shared subscription filter ($share/<group>/<filter>).
+
+    Args:
+        topic_filter (str): The filter as subscribed.
+
+    Returns:
+        tuple: The share group (or None for a normal subscription) and the filter.
+    """
+    if topic_filter.startswith("$share/"):
+        _, group, shared_filter = topic_filter.split("/", 2)
+        return group, shared_filter
+    return None, topic_filter
+
+def encode_length(length: int) -> bytes:
+    """
+    Encode the remaining length of a packet.
+
+    Args:
+        length (int): The number of bytes after the fixed header.
+
+    Returns:
+        bytes: The variable-length encoding.
+    """
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+def encode_string(value: str) -> bytes:
+    """
+    Encode a length-prefixed UTF-8 string.
+    """
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+def packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    """
+    Build a control packet.
+
+    Args:
+        packet_type (int): The control packet type.
+        flags (int): The flags in the low nibble of the first byte.
+        body (bytes): The variable header and payload.
+
+    Returns:
+        bytes: The encoded packet.
+    """
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+class Session:
+    """
+    A connected client and its subscriptions.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.client_id = ""
+        self.subscriptions = {}  # Topic filter -> granted QoS
+        self._packet_id = 0
+
+    def next_packet_id(self) -> int:
+        """
+        Allocate an ID for an outgoing QoS 1 message.
+        """
+        self._packet_id = self._packet_id % 65535 + 1
+        return self._packet_id
+
+    def deliver(self, topic: str, payload: bytes, qos: int):
+        """
+        Send a published message to the client.
+
+        Args:
+            topic (str): The topic of the message.
+            payload (bytes): The message payload.
+            qos (int): The QoS to deliver at (0 or 1).
+        """
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack("!H", self.next_packet_id())
+        self.writer.write(packet(PUBLISH, qos << 1, body + payload))
+
+class Broker:
+    """
+    A minimal in-process MQTT 3.1.1 broker for load tests.
+
+    Supports QoS 0 and 1 publishing, wildcard and shared ($share/<group>/...)
+    subscriptions and keep-alive pings, which is all the backend and the
+    scooters use. Messages on a shared subscription go to one member of the
+    group, in turn. Retained messages, wills and persistent sessions are not
+    supported. If given, on_publish is called with (topic, payload) for
+    every published message, on the broker's thread. Port 0 picks any free
+    port.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, on_publish=None):
+        self.host = host
+        self.port = port
+        self.on_publish = on_publish
+        self.sessions = set()
+        self._share_turns = {}  # (group, filter) -> messages delivered to the group
+        self._loop: asyncio.AbstractEventLoop = None
+        self._server: asyncio.base_events.Server = None
+
+    async def serve(self):
+        """
+        Start accepting connections.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def start_in_thread(self):
+        """
+        Run the broker on its own event loop in a daemon thread.
+
+        Returns:
+            int: The port the broker listens on.
+        """
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.serve())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True, name="mqtt-broker").start()
+        ready.wait()
+        return self.port
+
+    def stop(self):
+        """
+        Stop the broker started by start_in_thread().
+        """
+        def close():
+            self._server.close()
+            for session in list(self.sessions):
+                session.writer.close()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(close)
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0):
+        """
+        Route a message to every matching subscription.
+
+        Args:
+            topic (str): The topic of the message.
+            payload (bytes): The message payload.
+            qos (int): The QoS it was published with.
+        """
+        if self.on_publish is not None:
+            self.on_publish(topic, payload)
+        shared = {}  # (group, filter) -> [(session, granted QoS)]
+        for session in self.sessions:
+            granted = None
+            for topic_filter, sub_qos in session.subscriptions.items():
+                group, topic_filter = split_shared(topic_filter)
+                if not topic_matches(topic_filter, topic):
+                    continue
+                if group is None:
+                    granted = max(sub_qos, -1 if granted is None else granted)
+                else:
+                    shared.setdefault((group, topic_filter), []).append((session, sub_qos))
+            if granted is not None:
+                session.deliver(topic, payload, min(qos, granted))
+
+        for key, members in shared.items():
+            turn = self._share_turns.get(key, 0)
+            self._share_turns[key] = turn + 1
+            session, granted = members[turn % len(members)]
+            session.deliver(topic, payload, min(qos, granted))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serve one client connection.
+        """
+        session = Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                if not self._dispatch(session, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    def _dispatch(self, session: Session, packet_type: int, flags: int, body: bytes) -> bool:
+        """
+        Handle one control packet.
+
+        Returns:
+            bool: False if the connection should be closed.
+        """
+        if packet_type == CONNECT:
+            # Skip the protocol name, level, flags and keep-alive
+            offset = 2 + struct.unpack_from("!H", body)[0] + 4
+            size = struct.unpack_from("!H", body, offset)[0]
+            session.client_id = body[offset + 2:offset + 2 + size].decode()
+            session.writer.write(packet(CONNACK, 0, b"\x00\x00"))
+        elif packet_type == PUBLISH:
+            qos = flags >> 1 & 0x03
+            size = struct.unpack_from("!H", body)[0]
+            topic = body[2:2 + size].decode()
+            offset = 2 + size
+            if qos:
+                packet_id = struct.unpack_from("!H", body, offset)[0]
+                offset += 2
+                session.writer.write(packet(PUBACK, 0, struct.pack("!H", packet_id)))
+            self.publish(topic, body[offset:], qos)
+        elif packet_type == SUBSCRIBE:
+            packet_id = struct.unpack_from("!H", body)[0]
+            offset, granted = 2, bytearray()
+            while offset < len(body):
+                size = struct.unpack_from("!H", body, offset)[0]
+                topic_filter = body[offset + 2:offset + 2 + size].decode()
+                qos = min(body[offset + 2 + size] & 0x03, 1)
+                session.subscriptions[topic_filter] = qos
+                granted.append(qos)
+                offset += 3 + size
+            session.writer.write(packet(SUBACK, 0, struct.pack("!H", packet_id) + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = struct.unpack_from("!H", body)[0]
+            offset = 2
+            while offset < len(body):
+                size = struct.unpack_from("!H", body, offset)[0]
+                session.subscriptions.pop(body[offset + 2:offset + 2 + size].decode(), None)
+                offset += 2 + size
+            session.writer.write(packet(UNSUBACK, 0, struct.pack("!H", packet_id)))
+        elif packet_type == PINGREQ:
+            session.writer.write(packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        # PUBACKs from clients need no action, as nothing is redelivered
+        return True
@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+
+from broker import Broker
+from virtual_fleet import VirtualFleet
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+# Seconds to wait for the backend to start answering
+STARTUP_TIMEOUT = 30
+
+class LatencyRecorder:
+    """
+    Collects latency samples and errors per operation.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, ok: bool = True):
+        """
+        Record one operation. Safe to call from any thread.
+
+        Args:
+            name (str): The operation, e.g. "POST /book-scooter".
+            seconds (float): How long it took.
+            ok (bool): Whether it succeeded.
+        """
+        with self._lock:
+            self.samples[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def summary(self) -> dict:
+        """
+        Summarise the recorded operations.
+
+        Returns:
+            dict: Count, errors and p50/p95/p99 latency in milliseconds per operation.
+        """
+        summary = {}
+        for name, samples in sorted(self.samples.items()):
+            if len(samples) > 1:
+                cuts = statistics.quantiles(samples, n=100, method="inclusive")
+                p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+            else:
+                p50 = p95 = p99 = samples[0]
+            summary[name] = {
+                "count": len(samples),
+                "errors": self.errors[name],
+                "p50_ms": round(p50 * 1000, 1),
+                "p95_ms": round(p95 * 1000, 1),
+                "p99_ms": round(p99 * 1000, 1)
+            }
+        return summary
+
+class RoundTripTracker:
+    """
+    Times MQTT commands from the backend to the scooter's reply, as seen by the broker.
+    """
+
+    def __init__(self, recorder: LatencyRecorder):
+        self.recorder = recorder
+        self._sent = {}
+
+    def on_publish(self, topic: str, payload: bytes):
+        """
+        Broker hook, called for every published message.
+
+        Args:
+            topic (str): The topic of the message.
+            payload (bytes): The message payload.
+        """
+        if "/command/" not in topic and "/status/" not in topic and "/reply/" not in topic:
+            return
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if not isinstance(message, dict) or not message.get("id"):
+            return
+
+        if "/command/" in topic:
+            self._sent[message["id"]] = (message.get("command"), time.perf_counter())
+        else:
+            sent = self._sent.pop(message["id"], None)
+            if sent is not None:
+                command, started = sent
+                self.recorder.record(f"MQTT {command}", time.perf_counter() - started)
+
+def free_port() -> int:
+    """
+    Find a free TCP port on localhost.
+
+    Returns:
+        int: The port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def prepare_database(database: str, scooters: int) -> list:
+    """
+    Create a scratch database with one user per scooter.
+
+    Args:
+        database (str): The path of the database file.
+        scooters (int): The number of scooters and users.
+
+    Returns:
+        list: The IDs of the created scooters.
+    """
+    subprocess.run(
+        [sys.executable, "-c", "from db_setup import initialize_database; initialize_database()"],
+        cwd=BACKEND_DIR, env={**os.environ, "SCOOTER_DB": database}, check=True, stdout=subprocess.DEVNULL
+    )
+    conn = sqlite3.connect(database)
+    with conn:
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM scooters").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO scooters (id, lat, lng, battery) VALUES (?, 63.422 + ? * 0.0001, 10.395, 100)",
+            [(first + i, i) for i in range(scooters)]
+        )
+        conn.executemany(
+            "INSERT INTO users (username, password, email) VALUES (?, 'password', ?)",
+            [(f"load{i}", f"load{i}@ntnu.no") for i in range(scooters)]
+        )
+    conn.close()
+    return list(range(first, first + scooters))
+
+def load_fleet(database: str, scooter_ids: list) -> dict:
+    """
+    Read the fleet records of scooters, so virtual scooters report from where they are.
+
+    Args:
+        database (str): The path of the database file.
+        scooter_ids (list): The IDs of the scooters.
+
+    Returns:
+        dict: Scooter ID -> battery, lat and lng.
+    """
+    conn = sqlite3.connect(database)
+    rows = conn.execute(
+        f"SELECT id, battery, lat, lng FROM scooters WHERE id IN ({', '.join('?' * len(scooter_ids))})", scooter_ids
+    ).fetchall()
+    conn.close()
+    return {row[0]: {"battery": row[1], "lat": row[2], "lng": row[3]} for row in rows}
+
+def start_backend(database: str, port: int, broker_port: int, workers: int = 1) -> subprocess.Popen:
+    """
+    Start the backend in its own process, connected to the local broker.
+
+    Args:
+        database (str): The path of the database file.
+        port (int): The HTTP port.
+        broker_port (int): The port of the local broker.
+        workers (int): The number of uvicorn worker processes.
+
+    Returns:
+        subprocess.Popen: The backend process.
+    """
+    env = {**os.environ, "SCOOTER_DB": database, "MQTT_BROKER": "127.0.0.1", "MQTT_PORT": str(broker_port)}
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+            "--log-level", "warning"
+        ],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The backend did not start")
+
+async def timed(recorder: LatencyRecorder, name: str, request, ok=lambda response: response.status_code == 303):
+    """
+    Send a request and record its latency.
+
+    Args:
+        recorder (LatencyRecorder): Where to record the latency.
+        name (str): The operation name.
+        request (coroutine): The request to await.
+        ok (callable): Decides from the response whether it succeeded.
+
+    Returns:
+        httpx.Response: The response.
+    """
+    started = time.perf_counter()
+    response = await request
+    success = ok(response) and not any(cookie.endswith("_error") for cookie in response.cookies)
+    recorder.record(name, time.perf_counter() - started, success)
+    return response
+
+async def user_flow(base_url: str, user: int, scooter_id: int, ride_time: float, recorder: LatencyRecorder):
+    """
+    Log in, book a scooter, start a ride and end it.
+
+    Args:
+        base_url (str): The backend URL.
+        user (int): The index of the load test user.
+        scooter_id (int): The scooter to book.
+        ride_time (float): Seconds between starting and ending the ride.
+        recorder (LatencyRecorder): Where to record the latencies.
+    """
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        response = await timed(recorder, "POST /login", client.post(
+            "/login", data={"username": f"load{user}", "password": "password"}
+        ))
+        if "session" not in response.cookies:
+            return
+        client.cookies.set("session", response.cookies["session"])
+
+        await timed(recorder, "POST /book-scooter", client.post("/book-scooter", data={"scooter_id": scooter_id}))
+        response = await timed(recorder, "GET /bookings", client.get("/bookings"), lambda r: r.status_code == 200)
+        match = re.search(r'name="booking_id" value="(\d+)"', response.text)
+        if match is None:
+            return
+        booking_id = match.group(1)
+
+        await timed(recorder, "POST /activate-booking", client.post("/activate-booking", data={"booking_id": booking_id}))
+        await asyncio.sleep(ride_time)
+        await timed(
+            recorder, "POST /delete-booking", client.post("/delete-booking", data={"booking_id": booking_id}),
+            lambda r: r.status_code == 200 and "receipt" in r.text
+        )
+
+async def run_flows(base_url: str, scooter_ids: list, rounds: int, concurrency: int, ride_time: float,
+                    recorder: LatencyRecorder):
+    """
+    Run a user flow per scooter, for the given number of rounds.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited(user, scooter_id):
+        async with limit:
+            await user_flow(base_url, user, scooter_id, ride_time, recorder)
+
+    for _ in range(rounds):
+        await asyncio.gather(*(limited(user, scooter_id) for user, scooter_id in enumerate(scooter_ids)))
+
+def print_report(summary: dict):
+    """
+    Print the latency summary as a table.
+
+    Args:
+        summary (dict): The summary returned by LatencyRecorder.summary().
+    """
+    print(f"{'operation':<24} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in summary.items():
+        print(f"{name:<24} {row['count']:>6} {row['errors']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8}")
+
+def main():
+    """
+    Load test the backend with a virtual fleet of scooters.
+
+    Starts a local MQTT broker, the backend on a scratch database and the
+    simulated scooters, then runs concurrent book/activate/stop flows and
+    reports latency percentiles per endpoint and per MQTT round trip.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--scooters", type=int, default=50, help="number of simulated scooters and users")
+    parser.add_argument("--rounds", type=int, default=1, help="flows per user")
+    parser.add_argument("--concurrency", type=int, default=50, help="flows running at once")
+    parser.add_argument("--ride-time", type=float, default=1.0, help="seconds between activating and stopping")
+    parser.add_argument("--workers", type=int, default=1, help="backend worker processes")
+    parser.add_argument("--no-telemetry", action="store_true", help="do not publish scooter telemetry")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    recorder = LatencyRecorder()
+    broker = Broker(on_publish=RoundTripTracker(recorder).on_publish)
+    broker_port = broker.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "load_test.db")
+        scooter_ids = prepare_database(database, args.scooters)
+        port = free_port()
+        backend = start_backend(database, port, broker_port, args.workers)
+        fleet = VirtualFleet(scooter_ids, "127.0.0.1", broker_port, telemetry=not args.no_telemetry,
+                             fleet=load_fleet(database, scooter_ids))
+        try:
+            fleet.start()
+            started = time.perf_counter()
+            asyncio.run(run_flows(
+                f"http://127.0.0.1:{port}", scooter_ids, args.rounds, args.concurrency, args.ride_time, recorder
+            ))
+            elapsed = time.perf_counter() - started
+        finally:
+            fleet.stop()
+            backend.terminate()
+            backend.wait()
+            broker.stop()
+
+    summary = recorder.summary()
+    print(f"{args.scooters} scooters, {args.rounds} round(s), {args.workers} worker(s) in {elapsed:.1f} s")
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(summary, file, indent=2)
+
+if __name__ == "__main__":
+    main()
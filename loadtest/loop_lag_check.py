@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+import httpx
+
+from broker import Broker
+from load_test import (LatencyRecorder, free_port, load_fleet, prepare_database, print_report, run_flows,
+                       start_backend)
+from virtual_fleet import VirtualFleet
+
+# The admin account created by db_setup
+ADMIN_USERNAME = "admin"
+ADMIN_PASSWORD = "admin123"
+
+def fetch_loop_lag(base_url: str) -> dict:
+    """
+    Read the backend's event loop lag statistics.
+
+    Args:
+        base_url (str): The backend URL.
+
+    Returns:
+        dict: The statistics reported by /admin/loop-lag.
+    """
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        response = client.post("/login", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+        client.cookies.set("session", response.cookies["session"])
+        return client.get("/admin/loop-lag").json()
+
+def main():
+    """
+    Check that concurrent bookings never block the backend's event loop.
+
+    Starts the backend on a scratch database with a virtual fleet, books,
+    activates and ends rides concurrently through the real endpoints, then
+    reads the lag the backend measured on its own event loop. Exits with
+    status 1 if the lag exceeds the limit or any request fails.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookings", type=int, default=50, help="number of concurrent user flows")
+    parser.add_argument("--ride-time", type=float, default=1.0, help="seconds between activating and stopping")
+    parser.add_argument("--max-lag-ms", type=float, default=50, help="highest acceptable event loop lag")
+    args = parser.parse_args()
+
+    recorder = LatencyRecorder()
+    broker = Broker()
+    broker_port = broker.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "loop_lag.db")
+        scooter_ids = prepare_database(database, args.bookings)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        backend = start_backend(database, port, broker_port)
+        fleet = VirtualFleet(scooter_ids, "127.0.0.1", broker_port, fleet=load_fleet(database, scooter_ids))
+        try:
+            fleet.start()
+            # One flow first, so templates are compiled before the load starts
+            asyncio.run(run_flows(base_url, scooter_ids[:1], 1, 1, 0, LatencyRecorder()))
+            asyncio.run(run_flows(base_url, scooter_ids, 1, args.bookings, args.ride_time, recorder))
+            stats = fetch_loop_lag(base_url)
+        finally:
+            fleet.stop()
+            backend.terminate()
+            backend.wait()
+            broker.stop()
+
+    summary = recorder.summary()
+    print_report(summary)
+    print(f"{args.bookings} concurrent bookings, event loop lag: {stats}")
+    errors = sum(row["errors"] for row in summary.values())
+    sys.exit(0 if stats["max_ms"] <= args.max_lag_ms and not errors else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import sys
+
+# Run the real scooter code, with simulated sensors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scooter"))
+
+import helpers
+from gateway import Gateway
+from sensors import SimulatedSensors
+
+class VirtualFleet:
+    """
+    Simulated scooters running the real state machine and MQTT client.
+
+    The scooters are hosted by one gateway, as scooter/main.py runs them
+    when given several IDs: one stmpy driver and one MQTT connection for the
+    whole fleet. The simulated sensors never report an impact, so no
+    collision monitors are started.
+    """
+
+    def __init__(self, scooter_ids: list, broker: str, port: int, telemetry: bool = True, quiet: bool = True,
+                 fleet: dict = None):
+        self.broker = broker
+        self.port = port
+        self.quiet = quiet
+        # The fleet only lives as long as the test, so its outbox is kept in memory
+        self.gateway = Gateway(scooter_ids, SimulatedSensors, telemetry=telemetry, outbox_path=":memory:",
+                               fleet=fleet)
+        self.scooters = self.gateway.scooters
+
+    def start(self):
+        """
+        Start every scooter and connect to the broker.
+        """
+        if self.quiet:
+            # The scooters log every state change and message
+            helpers.pretty_print = lambda string, prefix: None
+            for module in ("scooter_handler", "mqtt_handler", "gateway"):
+                sys.modules[module].pretty_print = helpers.pretty_print
+
+        self.gateway.start(self.broker, self.port)
+
+    def stop(self):
+        """
+        Disconnect from the broker and stop every scooter.
+        """
+        self.gateway.stop()
@@ -0,0 +1,91 @@
+import threading
+
+from stmpy import Driver
+
+from helpers import pretty_print
+from mqtt_handler import MQTT_Client
+from outbox import outbox_file
+from scooter_handler import ScooterLogic, create_state_machine, TELEMETRY_INTERVAL
+from sensors import SimulatedSensors
+
+class Gateway:
+    """
+    Hosts any number of scooters in one process.
+
+    The state machines of all the scooters run on one stmpy driver and their
+    messages share one MQTT connection, which hands each command to the
+    scooter it is addressed to. Telemetry for all of them is reported from a
+    single thread. Only scooters whose sensors have an accelerometer or a
+    joystick get threads to watch them.
+
+    Args:
+        scooter_ids (list): The IDs of the scooters to host.
+        sensors (callable): Creates the sensor backend of each scooter.
+        telemetry (bool): Whether to report telemetry.
+        outbox_path (str): The file to keep unacknowledged statuses in,
+            by default one named after the scooter IDs.
+        fleet (dict): Scooter ID -> the battery, lat and lng in its fleet
+            record. Scooters left out report neither until they are known.
+    """
+
+    def __init__(self, scooter_ids: list, sensors=SimulatedSensors, telemetry: bool = True,
+                 outbox_path: str = None, fleet: dict = None):
+        self.telemetry = telemetry
+        self.driver = Driver()
+        self.mqtt_client = MQTT_Client(outbox_path or outbox_file(scooter_ids))
+        self.scooters = []
+        self._stopped = threading.Event()
+
+        for scooter_id in scooter_ids:
+            scooter = ScooterLogic(scooter_id, sensors())
+            record = (fleet or {}).get(scooter_id)
+            if record:
+                scooter.battery, scooter.lat, scooter.lng = record["battery"], record["lat"], record["lng"]
+            scooter.stm = create_state_machine(scooter)
+            scooter.driver = self.driver
+            self.driver.add_machine(scooter.stm)
+            self.mqtt_client.add_scooter(scooter)
+            self.scooters.append(scooter)
+
+    def start(self, broker: str, port: int):
+        """
+        Start every scooter and connect to the broker.
+
+        Args:
+            broker (str): The MQTT broker address.
+            port (int): The MQTT broker port.
+        """
+        self.driver.start()
+        self.mqtt_client.start(broker, port)
+
+        for scooter in self.scooters:
+            if scooter.sensors.has_imu:
+                threading.Thread(target=scooter.monitor_collision, daemon=True).start()
+            if scooter.sensors.has_joystick:
+                threading.Thread(target=scooter.watch_joystick, daemon=True).start()
+        if self.telemetry:
+            threading.Thread(target=self.report_telemetry, daemon=True).start()
+
+        pretty_print(f"Hosting {len(self.scooters)} scooter(s).", "SYSTEM")
+
+    def report_telemetry(self):
+        """
+        Periodically publish the telemetry of every scooter.
+        """
+        while True:
+            for scooter in self.scooters:
+                scooter.report_telemetry()
+            if self._stopped.wait(TELEMETRY_INTERVAL):
+                break
+
+    def stop(self):
+        """
+        Disconnect from the broker and stop every scooter.
+        """
+        self._stopped.set()
+        for scooter in self.scooters:
+            if scooter.imu_monitor:
+                scooter.imu_monitor.stop()
+            scooter.sensors.set_led_matrix(None)
+        self.mqtt_client.stop()
+        self.driver.stop()
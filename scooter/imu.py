@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# Accelerometer samples per second (override with IMU_SAMPLE_RATE); each sample is one
+# sensor read, so higher rates cost proportionally more CPU while riding
+SAMPLE_RATE = int(os.environ.get("IMU_SAMPLE_RATE", 100))
+# Seconds of samples checked for an impact at a time
+WINDOW_SECONDS = 0.5
+# Seconds between checks; windows overlap so an impact on a boundary is seen whole
+HOP_SECONDS = 0.1
+# Seconds between checks whether monitoring should resume
+IDLE_POLL_SECONDS = 0.2
+
+# Impact rules, with acceleration in g
+IMPACT_THRESHOLD = 2.5  # Peak magnitude
+# Change in magnitude between two consecutive samples. Below IMPACT_THRESHOLD - 1 g, so it
+# also catches the edge of a knock whose peak fell between samples; potholes rising by 1 g
+# over 20 ms or more change it by less at 100 Hz
+JERK_THRESHOLD_G_PER_SAMPLE = 1.2
+# The same in g per second, at SAMPLE_RATE
+JERK_THRESHOLD = JERK_THRESHOLD_G_PER_SAMPLE * SAMPLE_RATE
+SUSTAINED_THRESHOLD = 1.8  # Magnitude that must be held...
+SUSTAINED_SECONDS = 0.1  # ...for this long
+
+class AccelBuffer:
+    """
+    A fixed-size ring buffer of timestamped accelerometer samples.
+
+    Samples are stored as rows of (time, x, y, z) in a preallocated array,
+    so appending never allocates and the latest samples can be handed to
+    NumPy as one block.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._samples = np.zeros((capacity, 4))
+        self._next = 0
+        self.count = 0
+
+    def append(self, timestamp: float, x: float, y: float, z: float):
+        """
+        Add a sample, overwriting the oldest one if the buffer is full.
+        """
+        self._samples[self._next] = (timestamp, x, y, z)
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self, n: int) -> np.ndarray:
+        """
+        Get the latest samples, oldest first.
+
+        Args:
+            n (int): The number of samples (at most the number stored).
+
+        Returns:
+            np.ndarray: An (n, 4) array of (time, x, y, z) rows.
+        """
+        n = min(n, self.count)
+        start = self._next - n
+        if start >= 0:
+            return self._samples[start:self._next].copy()
+        return np.concatenate((self._samples[start:], self._samples[:self._next]))
+
+    def clear(self):
+        """
+        Drop every sample.
+        """
+        self._next = 0
+        self.count = 0
+
+def longest_run(mask: np.ndarray, times: np.ndarray) -> float:
+    """
+    Measure the longest stretch of consecutive samples where a condition holds.
+
+    Args:
+        mask (np.ndarray): Whether the condition holds at each sample.
+        times (np.ndarray): The sample times.
+
+    Returns:
+        float: The longest duration in seconds, 0 if the condition never holds.
+    """
+    if not mask.any():
+        return 0.0
+    # Indices where runs start and end, found from the edges of the mask
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return float((times[ends] - times[starts]).max())
+
+def detect_impact(samples: np.ndarray, jerk_threshold: float = JERK_THRESHOLD) -> tuple:
+    """
+    Check a window of accelerometer samples for an impact.
+
+    An impact is any of: a sample above IMPACT_THRESHOLD, a change in
+    magnitude between consecutive samples faster than jerk_threshold (a
+    sharp knock whose peak fell between samples), or a magnitude above
+    SUSTAINED_THRESHOLD held for SUSTAINED_SECONDS (e.g. a fall or a slide).
+
+    Args:
+        samples (np.ndarray): An (n, 4) array of (time, x, y, z) rows, oldest first.
+        jerk_threshold (float): The largest change in magnitude that is not
+            an impact, in g per second.
+
+    Returns:
+        tuple: Whether an impact occurred, and the peak magnitude, the
+        largest jerk and the longest sustained time in the window.
+    """
+    if len(samples) < 2:
+        return False, {"peak": 0.0, "jerk": 0.0, "sustained": 0.0}
+
+    times = samples[:, 0]
+    magnitude = np.sqrt(np.einsum("ij,ij->i", samples[:, 1:], samples[:, 1:]))
+    intervals = np.maximum(np.diff(times), 1e-6)
+
+    peak = float(magnitude.max())
+    jerk = float((np.abs(np.diff(magnitude)) / intervals).max())
+    sustained = longest_run(magnitude > SUSTAINED_THRESHOLD, times)
+
+    impact = peak > IMPACT_THRESHOLD or jerk > jerk_threshold or sustained >= SUSTAINED_SECONDS
+    return impact, {"peak": round(peak, 2), "jerk": round(jerk, 1), "sustained": round(sustained, 3)}
+
+class IMUMonitor:
+    """
+    Samples the accelerometer at a fixed rate and checks for impacts.
+
+    Samples go into a ring buffer. Every HOP_SECONDS the last WINDOW_SECONDS
+    of samples are checked in one vectorized pass. Checking a window rather
+    than each sample on its own adds the rules that span samples: the jerk
+    between consecutive samples, which sees the edge of a knock whose peak
+    fell between them, and a magnitude sustained over time. While riding the
+    sensor is read once per sample, as before; while not active (e.g. the
+    scooter is parked) it is not read at all.
+    """
+
+    def __init__(self, read_acceleration, rate: int = SAMPLE_RATE,
+                 window: float = WINDOW_SECONDS, hop: float = HOP_SECONDS):
+        self.read_acceleration = read_acceleration
+        self.rate = rate
+        self.window_size = max(int(window * rate), 2)
+        self.hop_size = max(int(hop * rate), 1)
+        self.jerk_threshold = JERK_THRESHOLD_G_PER_SAMPLE * rate
+        self.buffer = AccelBuffer(self.window_size)
+        self._stopped = threading.Event()
+
+    def run(self, on_impact, active=lambda: True):
+        """
+        Monitor until stop() is called.
+
+        Args:
+            on_impact (callable): Called with the impact details when an impact is detected.
+            active (callable): Returns whether to monitor right now.
+        """
+        period = 1 / self.rate
+        while not self._stopped.is_set():
+            if not active():
+                self.buffer.clear()
+                self._stopped.wait(IDLE_POLL_SECONDS)
+                continue
+
+            # Read on a fixed schedule, so the rate does not drift with the work done per sample
+            next_read = time.monotonic()
+            for _ in range(self.hop_size):
+                x, y, z = self.read_acceleration()
+                self.buffer.append(time.monotonic(), x, y, z)
+                next_read += period
+                delay = next_read - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            impact, details = detect_impact(self.buffer.latest(self.window_size), self.jerk_threshold)
+            if impact:
+                # Start afresh, so the same impact is not reported twice
+                self.buffer.clear()
+                on_impact(details)
+
+    def stop(self):
+        """
+        Stop monitoring.
+        """
+        self._stopped.set()
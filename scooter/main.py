@@ -1,50 +1,95 @@
+import argparse
 import threading
 
-from stmpy import Driver
-
+from gateway import Gateway
 from helpers import pretty_print
-from mqtt_handler import MQTT_Client, MQTT_BROKER, MQTT_PORT
-from scooter_handler import ScooterLogic, create_state_machine
-from sense_hat_handler import set_led_matrix
+from mqtt_handler import MQTT_BROKER, MQTT_PORT
+from sensors import SENSOR_BACKENDS, SenseHatSensors
+
+# Battery percent and position a scooter on the Sense HAT reports, which has
+# neither a battery gauge nor a GPS; simulated scooters report none by default
+DEFAULT_BATTERY = 100.0
+DEFAULT_POSITION = (63.422, 10.395)
+
+def parse_ids(value: str) -> list:
+    """
+    Parse a list of scooter IDs.
+
+    Args:
+        value (str): Comma-separated IDs and ranges, e.g. "1" or "1-200,250".
+
+    Returns:
+        list: The IDs.
+
+    Raises:
+        argparse.ArgumentTypeError: If the list is malformed.
+    """
+    ids = []
+    try:
+        for part in value.split(","):
+            first, _, last = part.partition("-")
+            ids.extend(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid scooter IDs: {value}") from None
+    if not ids:
+        raise argparse.ArgumentTypeError(f"invalid scooter IDs: {value}")
+    return ids
+
+def parse_position(value: str) -> tuple:
+    """
+    Parse a position.
+
+    Args:
+        value (str): The latitude and longitude, e.g. "63.422,10.395".
+
+    Returns:
+        tuple: The latitude and longitude.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not two numbers.
+    """
+    try:
+        lat, lng = (float(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid position: {value}") from None
+    return lat, lng
 
 def main():
     """
     Main entry point for the scooter system.
 
-    Sets up the state machine, MQTT client, and collision monitoring.
+    Runs one scooter on the Sense HAT by default. Given several IDs, runs as a
+    gateway hosting all of them on one state machine driver and one MQTT
+    connection.
     """
-    # State Machine Setup
-    scooter = ScooterLogic()
-    stm = create_state_machine(scooter)
-    scooter.stm = stm
-
-    # Driver Setup
-    driver = Driver()
-    driver.add_machine(stm)
-    scooter.driver = driver
-
-    # MQTT Setup
-    mqtt_client = MQTT_Client()
-    scooter.mqtt_client = mqtt_client.client
-    mqtt_client.stm_driver = driver
-    mqtt_client.scooter_id = scooter.scooter_id
-
-    # Start the system
-    driver.start()
-    mqtt_client.start(MQTT_BROKER, MQTT_PORT)
-
-    # Start collision monitoring in a separate thread
-    collision_thread = threading.Thread(target=scooter.monitor_collision, daemon=True)
-    collision_thread.start()
+    parser = argparse.ArgumentParser(description="Run one or more scooters")
+    parser.add_argument("--ids", type=parse_ids, default=[1], help="scooter IDs, e.g. 1 or 1-200,250 (default: 1)")
+    parser.add_argument("--sensors", choices=SENSOR_BACKENDS, default="sensehat", help="sensor backend of each scooter")
+    parser.add_argument("--battery", type=float, help="battery percent to start at (default: 100 on the Sense HAT)")
+    parser.add_argument("--position", type=parse_position,
+                        help="lat,lng to report (default: 63.422,10.395 on the Sense HAT)")
+    args = parser.parse_args()
+
+    sensors = SENSOR_BACKENDS[args.sensors]
+    if sensors is SenseHatSensors and len(args.ids) > 1:
+        parser.error("the Sense HAT can only serve one scooter, use --sensors simulated")
+
+    battery, position = args.battery, args.position
+    if sensors is SenseHatSensors:
+        battery = DEFAULT_BATTERY if battery is None else battery
+        position = position or DEFAULT_POSITION
+    lat, lng = position or (None, None)
+    fleet = {scooter_id: {"battery": battery, "lat": lat, "lng": lng} for scooter_id in args.ids}
+
+    gateway = Gateway(args.ids, sensors, fleet=fleet)
+    gateway.start(MQTT_BROKER, MQTT_PORT)
 
     pretty_print("Scooter system is running. Press Ctrl+C to stop.", "SYSTEM")
     try:
         threading.Event().wait()
     except KeyboardInterrupt:
         pretty_print("Stopping system...", "SYSTEM")
-        set_led_matrix(None)
-        driver.stop()
-        mqtt_client.client.disconnect()
+        gateway.stop()
 
 if __name__ == "__main__":
     main()
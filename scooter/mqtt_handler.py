@@ -1,25 +1,79 @@
+import json
+import os
+from collections import OrderedDict
 from threading import Thread
 
 from paho.mqtt.client import Client, MQTTMessage
-from stmpy import Driver
 
 from helpers import pretty_print
+from outbox import Outbox
 
-MQTT_BROKER = "mqtt.item.ntnu.no"
-MQTT_PORT = 1883
+# Broker address (override with MQTT_BROKER and MQTT_PORT, e.g. for load tests)
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "mqtt.item.ntnu.no")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
+# Commands for a scooter arrive on COMMAND_TOPIC/<scooter ID>
+COMMAND_TOPIC = "team20/scooter/command"
+# Command IDs remembered per connection to drop redelivered commands
+RECENT_COMMANDS = 1000
+
+def parse_command(payload: str):
+    """
+    Parse a command message from the backend.
+
+    Commands are JSON objects carrying the command, a correlation ID and the
+    topic to reply on. Plain-text commands are still accepted.
+
+    Args:
+        payload (str): The decoded message payload.
+
+    Returns:
+        tuple: The command, the correlation ID and the reply topic (or None).
+    """
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        return payload, None, None
+    if not isinstance(message, dict):
+        return payload, None, None
+    return message.get("command"), message.get("id"), message.get("reply_to")
 
 class MQTT_Client:
     """
     Handles MQTT communication for the scooter system.
+
+    One connection serves every scooter added to it. A single scooter
+    subscribes to its own command topic; a gateway hosting several
+    subscribes to all command topics with a wildcard and hands each command
+    to the scooter it is addressed to.
+
+    Commands are received and statuses published at QoS 1. A command the
+    broker delivers twice is handled once, by its ID. Statuses go through an
+    outbox, so they survive a lost connection or a restart.
+
+    Args:
+        outbox_path (str): The file to keep unacknowledged statuses in.
     """
 
-    def __init__(self):
+    def __init__(self, outbox_path: str):
         self.client: Client = Client()
-        self.stm_driver: Driver = None
-        self.scooter_id: int = None
+        self.scooters: dict = {}  # Scooter ID -> ScooterLogic, for the scooters on this connection
+        self.outbox = Outbox(self.client, outbox_path)
+        self._recent_commands = OrderedDict()  # IDs of the latest commands handled
+        self._outbox_thread: Thread = None
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
 
+    def add_scooter(self, scooter):
+        """
+        Send and receive a scooter's messages over this connection.
+
+        Args:
+            scooter (ScooterLogic): The scooter.
+        """
+        self.scooters[scooter.scooter_id] = scooter
+        scooter.mqtt_client = self.client
+        scooter.outbox = self.outbox
+
     def on_connect(self, client: Client, userdata, flags, rc):
         """
         Callback for when the client connects to the MQTT broker.
@@ -31,7 +85,10 @@ class MQTT_Client:
             rc: Connection result.
         """
         pretty_print("Connected to MQTT broker.", "MQTT")
-        client.subscribe(f"team20/scooter/command/{self.scooter_id}")
+        if len(self.scooters) == 1:
+            client.subscribe(f"{COMMAND_TOPIC}/{next(iter(self.scooters))}", qos=1)
+        else:
+            client.subscribe(f"{COMMAND_TOPIC}/+", qos=1)
 
     def on_message(self, client, userdata, msg: MQTTMessage):
         """
@@ -42,32 +99,70 @@ class MQTT_Client:
             userdata: User-defined data.
             msg (MQTTMessage): The received message.
         """
-        command = msg.payload.decode()
-        pretty_print(f"Received command: {command}", "MQTT")
-        state = self.stm_driver._stms_by_id['scooter'].state
+        try:
+            scooter = self.scooters.get(int(msg.topic.rsplit("/", 1)[-1]))
+        except ValueError:
+            return
+        if scooter is None:
+            # A scooter hosted elsewhere
+            return
+
+        command, command_id, reply_to = parse_command(msg.payload.decode())
+        if command_id is not None:
+            if command_id in self._recent_commands:
+                pretty_print(f"Dropping duplicate command for scooter {scooter.scooter_id}: {command}", "MQTT")
+                return
+            self._recent_commands[command_id] = None
+            if len(self._recent_commands) > RECENT_COMMANDS:
+                self._recent_commands.popitem(last=False)
+        pretty_print(f"Received command for scooter {scooter.scooter_id}: {command}", "MQTT")
+
+        stm = scooter.stm
+        state = stm.state
 
         if command == "start" and state == "Idle":
-            self.stm_driver.send('start', 'scooter')
+            trigger = 'start'
         elif command == "stop" and state == "Active":
-            self.stm_driver.send('stop', 'scooter')
-        elif command == "service_checked" and state == "Collision_detected":
-            self.stm_driver.send('service_checked', 'scooter')
+            trigger = 'stop'
+        elif command == "service_checked" and state in ("Collision_detected", "Awaiting_service"):
+            trigger = 'service_checked'
+        else:
+            return
+
+        # The status published by the transition answers this command
+        scooter.command_id = command_id
+        scooter.reply_to = reply_to
+        stm.send(trigger)
 
     def start(self, broker, port):
         """
         Start the MQTT client and connect to the broker.
 
+        Connecting does not wait for the broker: the client keeps retrying
+        in the background, and statuses wait in the outbox until it is connected.
+
         Args:
             broker (str): The MQTT broker address.
             port (int): The MQTT broker port.
         """
         pretty_print(f"Connecting to {broker}:{port}...", "MQTT")
-        self.client.connect(broker, port)
+        self.client.connect_async(broker, port)
 
+        self._outbox_thread = Thread(target=self.outbox.run, daemon=True)
+        self._outbox_thread.start()
         try:
-            thread = Thread(target=self.client.loop_forever)
+            thread = Thread(target=self.client.loop_forever, kwargs={"retry_first_connection": True})
             thread.start()
         except KeyboardInterrupt:
             pretty_print("Stopping MQTT client...", "MQTT")
             self.client.disconnect()
 
+    def stop(self):
+        """
+        Disconnect from the broker. Unacknowledged statuses stay in the outbox for the next start.
+        """
+        self.outbox.stop()
+        if self._outbox_thread:
+            self._outbox_thread.join(timeout=5)
+        self.client.disconnect()
+
@@ -0,0 +1,134 @@
+import os
+import queue
+import sqlite3
+import zlib
+
+from paho.mqtt.client import Client
+
+from helpers import pretty_print
+
+# File the outbox is kept in (override with SCOOTER_OUTBOX, ":memory:" to keep it in memory);
+# by default each set of scooters gets its own, named by outbox_file()
+OUTBOX_FILE = os.environ.get("SCOOTER_OUTBOX")
+# Messages kept at most; beyond it the oldest are dropped (override with SCOOTER_OUTBOX_LIMIT)
+OUTBOX_LIMIT = int(os.environ.get("SCOOTER_OUTBOX_LIMIT", 10000))
+
+def outbox_file(scooter_ids: list) -> str:
+    """
+    Name the outbox file of a process hosting the given scooters.
+
+    Processes started from the same directory get a file each, so none of
+    them resends or deletes the messages of another.
+
+    Args:
+        scooter_ids (list): The IDs of the scooters hosted.
+
+    Returns:
+        str: SCOOTER_OUTBOX if set, otherwise a file named after the IDs.
+    """
+    if OUTBOX_FILE:
+        return OUTBOX_FILE
+    if len(scooter_ids) == 1:
+        return f"outbox-{scooter_ids[0]}.db"
+    # The first and last ID alone would not tell apart e.g. 1-200 and 1,200
+    digest = zlib.crc32(",".join(map(str, sorted(scooter_ids))).encode())
+    return f"outbox-{min(scooter_ids)}-{max(scooter_ids)}-{digest:08x}.db"
+
+class Outbox:
+    """
+    Messages published at QoS 1, kept on disk until the broker acknowledges them.
+
+    put() only queues a message, so the state machine never waits on the
+    disk or the network. A single thread (run()) stores each message, then
+    publishes it. paho sends QoS 1 messages in order and sends the unacknowledged
+    ones again after a reconnect; the outbox covers what paho cannot, a restart
+    of the process, by publishing the messages left in the file before any new
+    ones. A message is deleted once its PUBACK arrives. While offline the
+    outbox keeps the latest limit messages and drops older ones, so the file
+    stops growing.
+
+    Args:
+        client (Client): The MQTT client to publish with.
+        path (str): The file to keep the outbox in.
+        limit (int): The most messages to keep.
+    """
+
+    def __init__(self, client: Client, path: str, limit: int = OUTBOX_LIMIT):
+        self.client = client
+        self.path = path
+        self.limit = limit
+        self._queue = queue.Queue()  # ("publish", topic, payload) or ("ack", MQTT message ID)
+        self._pending = {}  # MQTT message ID -> outbox row ID, for messages awaiting a PUBACK
+        self.client.on_publish = self.on_publish
+
+    def put(self, topic: str, payload: str):
+        """
+        Queue a message for publishing, without waiting.
+
+        Args:
+            topic (str): The topic to publish to.
+            payload (str): The message.
+        """
+        self._queue.put(("publish", topic, payload))
+
+    def on_publish(self, client: Client, userdata, mid: int):
+        """
+        Callback for when the broker acknowledges a message.
+
+        Runs on the network thread, so the outbox file is left to run().
+
+        Args:
+            client (Client): The MQTT client instance.
+            userdata: User-defined data.
+            mid (int): The MQTT message ID.
+        """
+        self._queue.put(("ack", mid))
+
+    def run(self):
+        """
+        Store, publish and delete messages until stop() is called.
+        """
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, topic TEXT NOT NULL, payload TEXT NOT NULL)")
+        conn.commit()
+
+        # Messages not acknowledged before the last shutdown go first
+        left_over = conn.execute("SELECT id, topic, payload FROM outbox ORDER BY id").fetchall()
+        if left_over:
+            pretty_print(f"Resending {len(left_over)} message(s) from the outbox.", "MQTT")
+        for row_id, topic, payload in left_over:
+            self._publish(row_id, topic, payload)
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if item[0] == "publish":
+                _, topic, payload = item
+                with conn:
+                    row_id = conn.execute("INSERT INTO outbox (topic, payload) VALUES (?, ?)", (topic, payload)).lastrowid
+                    # Row IDs count up, so rows more than limit behind this one are the oldest
+                    dropped = conn.execute("DELETE FROM outbox WHERE id <= ?", (row_id - self.limit,)).rowcount
+                if dropped:
+                    pretty_print(f"Outbox full, dropped {dropped} old message(s).", "MQTT")
+                self._publish(row_id, topic, payload)
+            else:
+                row_id = self._pending.pop(item[1], None)
+                if row_id is not None:
+                    with conn:
+                        conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+        conn.close()
+
+    def _publish(self, row_id: int, topic: str, payload: str):
+        # While disconnected paho keeps the message and sends it on reconnect
+        info = self.client.publish(topic, payload, qos=1)
+        # The PUBACK is queued behind this call, so it finds the message here
+        self._pending[info.mid] = row_id
+
+    def stop(self):
+        """
+        Stop once the messages queued so far are stored.
+        """
+        self._queue.put(None)
@@ -1,35 +1,63 @@
+import json
 import time
 
 from paho.mqtt.client import Client
 from stmpy import Machine, Driver
 
 from helpers import pretty_print
-from sense_hat_handler import blink_and_wait, detect_impact, check_orientation, set_led_matrix, GREEN, RED
+from imu import IMUMonitor
+from outbox import Outbox
+from sensors import SensorBackend, SenseHatSensors, GREEN, RED
+
+# Seconds between telemetry reports
+TELEMETRY_INTERVAL = 5
+# Battery percent used per telemetry interval while riding
+BATTERY_DRAIN = 0.5
+# Milliseconds the rider has to acknowledge a collision with the joystick
+ACKNOWLEDGE_TIMEOUT = 120000
+# Milliseconds between toggles of the LED matrix while waiting for an acknowledgement
+BLINK_INTERVAL = 200
+# Seconds between checks of the joystick
+JOYSTICK_POLL_INTERVAL = 0.05
 
 class ScooterLogic:
     """
     Handles the logic and state transitions for the scooter.
+
+    Args:
+        scooter_id (int): The ID of the scooter.
+        sensors (SensorBackend): The scooter's sensors (default: the Sense HAT).
     """
 
-    def __init__(self):
+    def __init__(self, scooter_id: int = 1, sensors: SensorBackend = None):
         self.stm: Machine = None
         self.mqtt_client: Client = None
+        self.outbox: Outbox = None  # Statuses are published through it, at QoS 1
         self.driver: Driver = None
-        self.scooter_id: int = 1
+        self.scooter_id: int = scooter_id
+        self.sensors: SensorBackend = sensors or SenseHatSensors()
+        self.command_id: str = None  # Correlation ID of the command being handled
+        self.reply_to: str = None  # Topic the backend expects the reply on
+        # Unknown until set from the scooter's fleet record; unknown values are not reported
+        self.battery: float = None
+        self.lat: float = None
+        self.lng: float = None
+        self.imu_monitor: IMUMonitor = None
+        self.led_lit: bool = False  # Whether the LED matrix is lit while blinking
 
     def lock(self):
         """
         Lock the scooter and set the LED matrix to red.
         """
-        pretty_print("Scooter locked.", "SCOOTER")
-        set_led_matrix(RED)
+        pretty_print(f"Scooter {self.scooter_id} locked.", "SCOOTER")
+        self.sensors.set_led_matrix(RED)
 
     def unlock(self):
         """
         Unlock the scooter and set the LED matrix to green.
         """
-        pretty_print("Scooter unlocked.", "SCOOTER")
-        set_led_matrix(GREEN)
+        pretty_print(f"Scooter {self.scooter_id} unlocked.", "SCOOTER")
+        self.sensors.set_led_matrix(GREEN)
 
     def publish_msg(self, msg):
         """
@@ -38,19 +66,65 @@ class ScooterLogic:
         Args:
             msg (str): The message to publish.
         """
-        topic = f"team20/scooter/status/{self.scooter_id}"
+        # The first status after a command is its reply, tagged with the
+        # correlation ID and sent to the backend process that asked
+        command_id, self.command_id = self.command_id, None
+        reply_to, self.reply_to = self.reply_to, None
+        topic = reply_to or f"team20/scooter/status/{self.scooter_id}"
         pretty_print(f"Publishing message: '{msg}' to topic: '{topic}'", "MQTT")
-        self.mqtt_client.publish(topic, msg)
+
+        # Queued rather than sent here, so the state machine never waits on the network
+        self.outbox.put(topic, json.dumps({"status": msg, "id": command_id}))
+
+    def publish_telemetry(self):
+        """
+        Publish the scooter's state to the MQTT broker, with its battery and
+        position if they are known.
+        """
+        report = {"state": self.stm.state}
+        if self.battery is not None:
+            report["battery"] = round(self.battery)
+        if self.lat is not None and self.lng is not None:
+            report["lat"] = self.lat
+            report["lng"] = self.lng
+        topic = f"team20/scooter/telemetry/{self.scooter_id}"
+        self.mqtt_client.publish(topic, json.dumps(report))
+
+    def report_telemetry(self):
+        """
+        Publish one telemetry report, draining the battery first while riding.
+
+        Called every TELEMETRY_INTERVAL seconds.
+        """
+        if self.stm.state == 'Active' and self.battery is not None:
+            self.battery = max(self.battery - BATTERY_DRAIN, 0)
+        self.publish_telemetry()
 
     def monitor_collision(self):
         """
         Continuously monitor for collisions and trigger state transitions.
+
+        The accelerometer is only sampled while the scooter is being ridden.
         """
-        while True:
-            impact, _ = detect_impact()
-            if impact and self.stm.state == 'Active':
+        def on_impact(details):
+            pretty_print(f"Impact detected on scooter {self.scooter_id}: {details}", "SCOOTER")
+            if self.stm.state == 'Active':
                 self.stm.send('collision')
-            time.sleep(0.01)
+
+        self.imu_monitor = IMUMonitor(self.sensors.read_acceleration)
+        self.imu_monitor.run(on_impact, active=lambda: self.stm.state == 'Active')
+
+    def watch_joystick(self):
+        """
+        Forward joystick presses to the state machine while a collision awaits acknowledgement.
+
+        Presses at any other time are dropped, so a stale press cannot
+        acknowledge a later collision.
+        """
+        while True:
+            if self.sensors.joystick_pressed() and self.stm.state == 'Collision_detected':
+                self.stm.send('acknowledged')
+            time.sleep(JOYSTICK_POLL_INTERVAL)
 
     def check_orientation_stop(self):
         """
@@ -59,7 +133,7 @@ class ScooterLogic:
         Returns:
             str: The next state ('Idle').
         """
-        orientation = check_orientation()
+        orientation = self.sensors.check_orientation()
         if orientation == RED:
             self.publish_msg("parked_increased_fare")
         else:
@@ -73,31 +147,61 @@ class ScooterLogic:
         Returns:
             str: The next state ('Active' or 'Collision_detected').
         """
-        orientation = check_orientation()
+        orientation = self.sensors.check_orientation()
         if orientation == GREEN:
             return "Active"
         return "Collision_detected"
     
-    def handle_collision_response(self):
+    def start_alert(self):
         """
-        Handle the response logic after a collision, including user acknowledgment.
+        Start blinking the LED matrix and waiting for the rider to acknowledge the collision.
+
+        Runs on timers, so the state machine keeps handling commands (such as
+        service_checked) while it waits.
         """
-        user_acknowledged = blink_and_wait(timeout=120)
+        self.led_lit = False
+        self.stm.start_timer('blink', BLINK_INTERVAL)
+        self.stm.start_timer('acknowledge_timeout', ACKNOWLEDGE_TIMEOUT)
 
-        set_led_matrix(RED)
+    def blink(self):
+        """
+        Toggle the LED matrix between red and off.
+        """
+        self.led_lit = not self.led_lit
+        self.sensors.set_led_matrix(RED if self.led_lit else None)
+        self.stm.start_timer('blink', BLINK_INTERVAL)
 
-        if user_acknowledged:
-            pretty_print("User acknowledged collision.", "SCOOTER")
-            self.publish_msg("collision_acknowledged")
-        else:
-            pretty_print("No user response to collision.", "SCOOTER")
-            self.publish_msg("collision_no_response")
+    def stop_alert(self):
+        """
+        Stop blinking and waiting for an acknowledgement, and leave the LED matrix red.
+        """
+        self.stm.stop_timer('blink')
+        self.stm.stop_timer('acknowledge_timeout')
+        self.sensors.set_led_matrix(RED)
+
+    def collision_acknowledged(self):
+        """
+        Report that the rider acknowledged the collision.
+        """
+        pretty_print(f"User acknowledged collision of scooter {self.scooter_id}.", "SCOOTER")
+        self.publish_msg("collision_acknowledged")
+
+    def collision_no_response(self):
+        """
+        Report that the rider did not acknowledge the collision in time.
+        """
+        pretty_print(f"No user response to collision of scooter {self.scooter_id}.", "SCOOTER")
+        self.publish_msg("collision_no_response")
 
 # State Machine Definition
 def create_state_machine(scooter_logic: ScooterLogic):
     """
     Create the state machine for the scooter.
 
+    The machine is named scooter_<ID>: stmpy keeps machine names in a
+    registry shared by every driver in the process, so each scooter hosted
+    in a process needs a name of its own.
+
     Args:
         scooter_logic (ScooterLogic): The scooter logic instance.
 
@@ -109,11 +213,16 @@ def create_state_machine(scooter_logic: ScooterLogic):
     t2 = {'source': 'Active', 'trigger': 'stop', 'function': scooter_logic.check_orientation_stop}
     t3 = {'source': 'Collision_detected', 'trigger': 'service_checked', 'target': 'Idle', 'effect': 'publish_msg("parked")'}
     t4 = {'source': 'Active', 'trigger': 'collision', 'function': scooter_logic.check_orientation_collision}
+    t5 = {'source': 'Collision_detected', 'trigger': 'acknowledged', 'target': 'Awaiting_service', 'effect': 'collision_acknowledged()'}
+    t6 = {'source': 'Collision_detected', 'trigger': 'acknowledge_timeout', 'target': 'Awaiting_service', 'effect': 'collision_no_response()'}
+    t7 = {'source': 'Awaiting_service', 'trigger': 'service_checked', 'target': 'Idle', 'effect': 'publish_msg("parked")'}
 
     states = [
         {'name': 'Idle', 'entry': 'lock()'},
         {'name': 'Active'},
-        {'name': 'Collision_detected', 'entry': 'lock(); publish_msg("collision"); handle_collision_response()'}
+        # Blinks until the rider acknowledges the collision or the timeout expires
+        {'name': 'Collision_detected', 'entry': 'lock(); publish_msg("collision"); start_alert()', 'exit': 'stop_alert()', 'blink': 'blink()'},
+        {'name': 'Awaiting_service', 'entry': 'lock()'}
     ]
 
-    return Machine(name='scooter', transitions=[t0, t1, t2, t3, t4], obj=scooter_logic, states=states)
\ No newline at end of file
+    return Machine(name=f'scooter_{scooter_logic.scooter_id}', transitions=[t0, t1, t2, t3, t4, t5, t6, t7], obj=scooter_logic, states=states)
\ No newline at end of file
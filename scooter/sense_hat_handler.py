@@ -1,17 +1,10 @@
-import math
-import time
-
 from sense_hat import SenseHat
 
+from sensors import GREEN, RED, YELLOW
+
 # Initialize Sense HAT
 sense = SenseHat()
-sense.set_imu_config(True, False, False)  # Use only accelerometer
-
-# Constants
-IMPACT_THRESHOLD = 2.5  # Adjust for sensitivity
-GREEN = (0, 255, 0)
-RED = (255, 0, 0)
-YELLOW = (255, 255, 0)
+sense.set_imu_config(False, False, True)  # Use only accelerometer (compass, gyro, accel)
 
 def get_acceleration():
     """
@@ -23,16 +16,15 @@ def get_acceleration():
     accel = sense.get_accelerometer()
     return accel['roll'], accel['pitch']
 
-def detect_impact():
+def read_acceleration():
     """
-    Detect sudden impacts based on the magnitude of acceleration.
+    Read the raw acceleration along each axis.
 
     Returns:
-        tuple: A boolean indicating if an impact occurred and the magnitude of acceleration.
+        tuple: The x, y and z acceleration in g.
     """
     accel = sense.get_accelerometer_raw()
-    magnitude = math.sqrt(accel['x']**2 + accel['y']**2 + accel['z']**2)
-    return magnitude > IMPACT_THRESHOLD, magnitude
+    return accel['x'], accel['y'], accel['z']
 
 def check_orientation():
     """
@@ -66,29 +58,11 @@ def set_led_matrix(color):
     else:
         sense.clear(color)
 
-def blink_red():
-    """
-    Blink the LED matrix red to indicate an impact alert.
-    """
-    sense.clear(RED)
-    time.sleep(0.2)
-    sense.clear()
-    time.sleep(0.2)
-
-def blink_and_wait(timeout=120):
+def joystick_pressed():
     """
-    Blink the LED matrix red and wait for joystick input.
-
-    Args:
-        timeout (int): Time in seconds to wait for user input.
+    Check whether the joystick was pressed since the last check.
 
     Returns:
-        bool: True if the user acknowledges, False otherwise.
+        bool: True if the joystick was pressed, False otherwise.
     """
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        blink_red()
-        events = sense.stick.get_events()
-        if any(event.action == "pressed" for event in events):
-            return True
-    return False
+    return any(event.action == "pressed" for event in sense.stick.get_events())
@@ -0,0 +1,108 @@
+# Colors of the LED matrix, also used to report the orientation
+GREEN = (0, 255, 0)
+RED = (255, 0, 0)
+YELLOW = (255, 255, 0)
+
+class SensorBackend:
+    """
+    The sensors and LED matrix of one scooter.
+
+    Subclasses connect a scooter to its hardware, or simulate it. has_imu and
+    has_joystick tell whether there is an accelerometer to watch for
+    collisions and a joystick to acknowledge them with; no threads are
+    started to watch sensors a backend does not have.
+    """
+
+    has_imu = True
+    has_joystick = True
+
+    def read_acceleration(self) -> tuple:
+        """
+        Read the raw acceleration along each axis.
+
+        Returns:
+            tuple: The x, y and z acceleration in g.
+        """
+        raise NotImplementedError
+
+    def check_orientation(self) -> tuple:
+        """
+        Determine the orientation of the scooter.
+
+        Returns:
+            tuple: GREEN if upright, YELLOW if slightly tilted, RED otherwise.
+        """
+        raise NotImplementedError
+
+    def set_led_matrix(self, color):
+        """
+        Set the LED matrix to a color.
+
+        Args:
+            color (tuple or None): RGB color tuple or None to clear the matrix.
+        """
+        raise NotImplementedError
+
+    def joystick_pressed(self) -> bool:
+        """
+        Check whether the joystick was pressed since the last check.
+
+        Returns:
+            bool: True if the joystick was pressed, False otherwise.
+        """
+        raise NotImplementedError
+
+class SenseHatSensors(SensorBackend):
+    """
+    The Sense HAT of the Raspberry Pi the scooter runs on.
+
+    There is one Sense HAT per Pi, so it can serve only one scooter.
+    """
+
+    def __init__(self):
+        # Imported here, as the sense_hat package is only installed on the Pi
+        import sense_hat_handler
+        self._handler = sense_hat_handler
+
+    def read_acceleration(self) -> tuple:
+        return self._handler.read_acceleration()
+
+    def check_orientation(self) -> tuple:
+        return self._handler.check_orientation()
+
+    def set_led_matrix(self, color):
+        self._handler.set_led_matrix(color)
+
+    def joystick_pressed(self) -> bool:
+        return self._handler.joystick_pressed()
+
+class SimulatedSensors(SensorBackend):
+    """
+    A scooter standing still and upright that never reports an impact, for
+    simulations and load tests. Set orientation to simulate parking tilted.
+    """
+
+    has_imu = False
+    has_joystick = False
+
+    def __init__(self):
+        self.orientation = GREEN
+        self.led_color = None
+
+    def read_acceleration(self) -> tuple:
+        return 0.0, 0.0, 1.0
+
+    def check_orientation(self) -> tuple:
+        return self.orientation
+
+    def set_led_matrix(self, color):
+        self.led_color = color
+
+    def joystick_pressed(self) -> bool:
+        return False
+
+# Sensor backends by the name used on the command line
+SENSOR_BACKENDS = {
+    "sensehat": SenseHatSensors,
+    "simulated": SimulatedSensors,
+}